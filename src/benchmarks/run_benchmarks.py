@@ -0,0 +1,182 @@
+# Time the preprocessing, feature and plotting pipeline on synthetic data, writing the results as JSON
+#
+# Run from src with e.g. python -m benchmarks.run_benchmarks --output benchmark_results.json
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+import statistics
+import numpy as np
+import polars as pl
+import matplotlib
+from .synthetic_data import generate_synthetic_data
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _time(setup, repeat):
+    # Run the setup and timed part separately, so only the timed part counts
+    seconds = []
+    for _ in range(repeat):
+        timed_function = setup()
+        start = time.perf_counter()
+        timed_function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_benchmarks(file_paths: dict, repeat: int = 3, n_feature_plays: int = 20, n_animated_plays: int = 1) -> dict:
+    """
+    Time each stage of the pipeline on the csvs in file_paths, which are keyed like the arguments of
+    BigDataBowlData. Every benchmark builds its inputs outside the timed section and is repeated
+    repeat times.
+
+    """
+    # Imported here so the plotting backend is set before pyplot is loaded
+    matplotlib.use("Agg")
+    from preprocessing.preprocessing import BigDataBowlData
+    from preprocessing.play_prediction import PlayPredictionModel
+    from plotting.plotting import PlotPlayVertical
+    from plotting.raster import RasterPlayVertical
+
+    def load_data():
+        return BigDataBowlData(**file_paths)
+
+    def loaded_data():
+        data = load_data()
+        _ = data.plays_df, data.tracking_data
+        return data
+
+    warm_data = load_data().warm()
+    play_ids = warm_data.plays_df.\
+        join(warm_data.line_set_tracking, on=["gameId", "playId"], how="semi").\
+        select("gameId", "playId").rows()
+    feature_play_ids = play_ids[:n_feature_plays]
+    animated_plays = [warm_data.get_play_tracking(*play_id).collect() for play_id in play_ids[:n_animated_plays]]
+
+    # Each setup function builds the inputs and returns the function to time
+    def setup_load_non_tracking_data():
+        data = load_data()
+        return lambda: data.plays_df
+
+    def setup_load_tracking_data():
+        data = load_data()
+        return lambda: data.tracking_data.collect()
+
+    def setup_key_frame_extraction():
+        data = loaded_data()
+        return lambda: data.key_event_tracking
+
+    def setup_build_play_indexes():
+        # Load the frames the indexes are built from, so only building the indexes is timed
+        data = loaded_data()
+        _ = data.raw_player_plays, data.key_event_tracking
+        return lambda: [data._get_play_index(name) for name in data._get_play_index_names()]
+
+    def setup_iter_plays():
+        data = load_data().warm()
+        return lambda: [play for batch in data.iter_plays() for play in batch]
+
+    def setup_per_play_features():
+        model = PlayPredictionModel(warm_data)
+        return lambda: [model.get_model_features(*play_id) for play_id in feature_play_ids]
+
+    def setup_batch_features():
+        return PlayPredictionModel(warm_data).build_feature_tables
+
+    def setup_pre_snap_motion_features():
+        return PlayPredictionModel(warm_data).build_pre_snap_motion_features
+
+    with tempfile.TemporaryDirectory() as animation_dir:
+        def setup_animation(plot_class):
+            return lambda: lambda: [plot_class(play).animate_play(save_path=os.path.join(animation_dir, "play.gif")) for play in animated_plays]
+
+        benchmarks = {
+            "load_non_tracking_data": (setup_load_non_tracking_data, 1),
+            "load_tracking_data": (setup_load_tracking_data, 1),
+            "key_frame_extraction": (setup_key_frame_extraction, 1),
+            "build_play_indexes": (setup_build_play_indexes, 1),
+            "iter_plays": (setup_iter_plays, len(play_ids)),
+            "per_play_features": (setup_per_play_features, len(feature_play_ids)),
+            "batch_features": (setup_batch_features, len(play_ids)),
+            "pre_snap_motion_features": (setup_pre_snap_motion_features, len(play_ids)),
+            "animate_play_matplotlib": (setup_animation(PlotPlayVertical), len(animated_plays)),
+            "animate_play_raster": (setup_animation(RasterPlayVertical), len(animated_plays)),
+        }
+
+        results = {}
+        for name, (setup, n_items) in benchmarks.items():
+            seconds = _time(setup, repeat)
+            results[name] = {
+                "seconds": seconds,
+                "min_seconds": min(seconds),
+                "median_seconds": statistics.median(seconds),
+                "n_items": n_items,
+                "median_seconds_per_item": statistics.median(seconds) / n_items if n_items else None,
+            }
+            print(f"{name}: median {results[name]['median_seconds']:.3f}s over {repeat} runs", file=sys.stderr)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Big Data Bowl pipeline on synthetic data.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Path of the JSON results file")
+    parser.add_argument("--data-dir", default=None, help="Directory for the synthetic csvs, a temporary directory if not given")
+    parser.add_argument("--weeks", type=int, default=2)
+    parser.add_argument("--games-per-week", type=int, default=4)
+    parser.add_argument("--plays-per-game", type=int, default=20)
+    parser.add_argument("--frames-per-play", type=int, default=60)
+    parser.add_argument("--missing-event-rate", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--feature-plays", type=int, default=20, help="Number of plays for the per play feature benchmark")
+    parser.add_argument("--animated-plays", type=int, default=1, help="Number of plays for the animation benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    synthetic_config = {
+        "n_weeks": args.weeks,
+        "games_per_week": args.games_per_week,
+        "plays_per_game": args.plays_per_game,
+        "frames_per_play": args.frames_per_play,
+        "missing_event_rate": args.missing_event_rate,
+        "seed": args.seed,
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_paths = generate_synthetic_data(args.data_dir or temp_dir, **synthetic_config)
+        results = run_benchmarks(file_paths, repeat=args.repeat, n_feature_plays=args.feature_plays, n_animated_plays=args.animated_plays)
+
+    report = {
+        "commit": _get_git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "polars": pl.__version__,
+            "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__,
+        },
+        "synthetic_data": synthetic_config,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# Generate synthetic csvs with the same layout as the Kaggle data, for benchmarking without the real data
+import os
+import numpy as np
+import polars as pl
+from config import Constants
+from preprocessing.non_tracking_data import TEAM_ABBREVIATIONS
+
+
+DEFAULT_EVENT_FRAMES = {
+    "huddle_break_offense": 1,
+    "line_set": 10,
+    "man_in_motion": 18,
+    "ball_snap": 25,
+    "pass_forward": 30,
+}
+
+TRACKING_COLUMNS = ["gameId", "playId", "nflId", "displayName", "frameId", "frameType", "time", "jerseyNumber", "club",
+                    "playDirection", "x", "y", "s", "a", "dis", "o", "dir", "event"]
+
+
+def _generate_players(teams):
+    return pl.DataFrame({
+        "nflId": [team_index * 100 + 40000 + i for team_index in range(len(teams)) for i in range(Constants.PLAYERS_PER_TEAM)],
+        "height": "6-2",
+        "weight": 220,
+        "birthDate": "1996-01-01",
+        "collegeName": "Synthetic",
+        "position": ["QB", "RB", "WR", "WR", "WR", "TE", "T", "G", "C", "G", "T"] * len(teams),
+        "displayName": [f"{team} Player {i + 1}" for team in teams for i in range(Constants.PLAYERS_PER_TEAM)],
+    })
+
+
+def _generate_games(teams, n_weeks, games_per_week):
+    games = []
+    for week in range(1, n_weeks + 1):
+        for game in range(games_per_week):
+            home = teams[(2 * game + week) % len(teams)]
+            away = teams[(2 * game + week + 1) % len(teams)]
+            games.append({
+                "gameId": 2022090800 + week * 100 + game,
+                "season": 2022,
+                "week": week,
+                "gameDate": f"09/{week + 7:02d}/2022",
+                "gameTimeEastern": "13:00:00",
+                "homeTeamAbbr": home,
+                "visitorTeamAbbr": away,
+                "homeFinalScore": 24,
+                "visitorFinalScore": 17,
+            })
+    return pl.DataFrame(games)
+
+
+def _generate_plays(rng, games, plays_per_game):
+    plays = games.select("gameId", "week", "homeTeamAbbr", "visitorTeamAbbr").\
+        join(pl.DataFrame({"play_number": np.arange(plays_per_game)}), how="cross")
+    n_plays = len(plays)
+
+    is_home_possession = plays["play_number"].to_numpy() % 2 == 0
+    is_pass = rng.random(n_plays) < 0.6
+    pass_result = np.where(is_pass, rng.choice(["C", "I", "S", "IN"], n_plays, p=[0.6, 0.3, 0.07, 0.03]), "")
+
+    return plays.with_columns(
+        playId=pl.col("play_number") * 25 + 50,
+        possessionTeam=pl.when(pl.Series(is_home_possession)).then(pl.col("homeTeamAbbr")).otherwise(pl.col("visitorTeamAbbr")),
+        defensiveTeam=pl.when(pl.Series(is_home_possession)).then(pl.col("visitorTeamAbbr")).otherwise(pl.col("homeTeamAbbr")),
+    ).select(
+        "gameId",
+        "playId",
+        playDescription=pl.lit("Synthetic play"),
+        quarter=pl.Series(rng.integers(1, 5, n_plays)),
+        down=pl.Series(rng.integers(1, 5, n_plays)),
+        yardsToGo=pl.Series(rng.integers(1, 11, n_plays)),
+        possessionTeam=pl.col("possessionTeam"),
+        defensiveTeam=pl.col("defensiveTeam"),
+        yardlineSide=pl.col("possessionTeam"),
+        yardlineNumber=pl.Series(rng.integers(1, 50, n_plays)),
+        gameClock=pl.Series([f"{minutes:02d}:{seconds:02d}" for minutes, seconds in zip(rng.integers(0, 15, n_plays), rng.integers(0, 60, n_plays))]),
+        preSnapHomeScore=pl.lit(7),
+        preSnapVisitorScore=pl.lit(3),
+        passResult=pl.Series(pass_result),
+        preSnapHomeTeamWinProbability=pl.lit(0.6),
+        preSnapVisitorTeamWinProbability=pl.lit(0.4),
+        expectedPoints=pl.Series(rng.uniform(0, 4, n_plays)),
+        offenseFormation=pl.Series(rng.choice(["SHOTGUN", "SINGLEBACK", "EMPTY", "I_FORM", "PISTOL"], n_plays)),
+        receiverAlignment=pl.Series(rng.choice(["2x2", "3x1", "2x1", "3x2"], n_plays)),
+        playAction=pl.Series(np.where(is_pass & (rng.random(n_plays) < 0.2), "TRUE", "FALSE")),
+        dropbackType=pl.Series(np.where(is_pass, "TRADITIONAL", "NA")),
+        isDropback=pl.Series(np.where(is_pass, "TRUE", "FALSE")),
+        pff_passCoverage=pl.Series(rng.choice(["Cover-1", "Cover-2", "Cover-3", "Quarters"], n_plays)),
+        pff_manZone=pl.Series(rng.choice(["Man", "Zone"], n_plays)),
+        homeTeamWinProbabilityAdded=pl.Series(rng.normal(0, 0.02, n_plays)),
+        visitorTeamWinProbilityAdded=pl.Series(rng.normal(0, 0.02, n_plays)),
+        expectedPointsAdded=pl.Series(rng.normal(0, 1, n_plays)),
+    ).with_columns(week=plays["week"])
+
+
+def _get_team_players(plays, players, teams):
+    # One row per player per play, ordered by nflId like the Kaggle files
+    team_players = pl.DataFrame({
+        "club": np.repeat(teams, Constants.PLAYERS_PER_TEAM),
+        "nflId": players["nflId"],
+        "displayName": players["displayName"],
+        "player_index": np.tile(np.arange(Constants.PLAYERS_PER_TEAM), len(teams)),
+    })
+    offense = plays.select("gameId", "playId", "week", club="possessionTeam").join(team_players, on="club").with_columns(is_offense=True)
+    defense = plays.select("gameId", "playId", "week", club="defensiveTeam").join(team_players, on="club").with_columns(is_offense=False)
+    # The tracking is built by reshaping these rows per play, so the order matters
+    return pl.concat([offense, defense]).sort(["gameId", "playId", "nflId"])
+
+
+def _generate_player_play(rng, play_players):
+    n_rows = len(play_players)
+
+    def random_boolean():
+        return pl.Series(rng.choice(["TRUE", "FALSE", "NA"], n_rows, p=[0.2, 0.7, 0.1]))
+
+    return play_players.select(
+        "gameId",
+        "playId",
+        "nflId",
+        teamAbbr="club",
+        motionSinceLineset=random_boolean(),
+        shiftSinceLineset=random_boolean(),
+        inMotionAtBallSnap=random_boolean(),
+        wasTargettedReceiver=pl.Series((rng.random(n_rows) < 0.05).astype(int)),
+        routeRan=pl.when(pl.col("is_offense")).then(pl.Series(rng.choice(["GO", "SLANT", "OUT", "HITCH"], n_rows))).otherwise(pl.lit("NA")),
+        yardageGainedAfterTheCatch=pl.Series(np.where(rng.random(n_rows) < 0.1, rng.integers(0, 10, n_rows).astype(str), "NA")),
+        pff_defensiveCoverageAssignment=pl.when(pl.col("is_offense")).then(pl.lit("NA")).otherwise(pl.lit("MAN")),
+    )
+
+
+def _generate_week_tracking(rng, week_plays, week_players, frames_per_play, event_frames, missing_event_rate):
+    n_plays = len(week_plays)
+    n_players = 2 * Constants.PLAYERS_PER_TEAM
+    frame_ids = np.arange(1, frames_per_play + 1)
+
+    line_of_scrimmage = rng.uniform(25, 95, n_plays)
+    is_left = rng.random(n_plays) < 0.5
+
+    # Start the offense behind the line of scrimmage and the defense in front of it, in the normalised direction
+    is_offense = week_players["is_offense"].to_numpy().reshape(n_plays, n_players)
+    player_index = week_players["player_index"].to_numpy().reshape(n_plays, n_players)
+    depth = rng.uniform(0.5, 10, (n_plays, n_players)) * np.where(is_offense, -1, 1)
+    start_x = line_of_scrimmage[:, np.newaxis] + depth
+    start_y = rng.uniform(5, Constants.Y_MAX - 5, (n_plays, n_players))
+
+    # Everyone drifts slowly, and one receiver runs across the field between line_set and ball_snap
+    line_set_frame, ball_snap_frame = event_frames.get("line_set", 1), event_frames.get("ball_snap", frames_per_play)
+    in_motion_frames = np.clip(frame_ids - line_set_frame, 0, ball_snap_frame - line_set_frame)
+    is_motion_player = is_offense & (player_index == 3)
+    x = start_x[:, np.newaxis, :] + 0.01 * frame_ids[np.newaxis, :, np.newaxis]
+    y = start_y[:, np.newaxis, :] + np.where(is_motion_player[:, np.newaxis, :], 0.5 * in_motion_frames[np.newaxis, :, np.newaxis], 0)
+    y = np.clip(y, 0, Constants.Y_MAX)
+
+    # Append the football as the last entity
+    x = np.concatenate([x, np.broadcast_to(line_of_scrimmage[:, np.newaxis, np.newaxis], (n_plays, frames_per_play, 1))], axis=2)
+    y = np.concatenate([y, np.full((n_plays, frames_per_play, 1), Constants.Y_MAX / 2)], axis=2)
+    # Store the raw direction of play, the pipeline normalises it back
+    x = np.where(is_left[:, np.newaxis, np.newaxis], Constants.X_MAX - x, x)
+
+    n_entities = n_players + 1
+    shape = (n_plays, frames_per_play, n_entities)
+    speed = rng.uniform(0, 1.5, shape)
+    speed[..., -1] = 0
+
+    events = np.full(frames_per_play, "", dtype=object)
+    for event, frame_id in event_frames.items():
+        if 1 <= frame_id <= frames_per_play:
+            events[frame_id - 1] = event
+    play_events = np.tile(events, (n_plays, 1))
+    # Drop line_set from some plays, like real plays without a set formation
+    dropped = rng.random(n_plays) < missing_event_rate
+    play_events[dropped] = np.where(play_events[dropped] == "line_set", "", play_events[dropped])
+
+    def per_entity(player_values, football_value):
+        values = np.concatenate([player_values.reshape(n_plays, n_players), np.full((n_plays, 1), football_value)], axis=1)
+        return np.broadcast_to(values[:, np.newaxis, :], shape)
+
+    def per_frame(values):
+        return np.broadcast_to(values[np.newaxis, :, np.newaxis] if values.ndim == 1 else values[:, :, np.newaxis], shape)
+
+    def per_play(values):
+        return np.broadcast_to(values[:, np.newaxis, np.newaxis], shape)
+
+    frame_type = np.where(frame_ids < ball_snap_frame, "BEFORE_SNAP", np.where(frame_ids == ball_snap_frame, "SNAP", "AFTER_SNAP"))
+    frame_time = np.array([f"2022-09-08 13:00:{Constants.FRAME_DURATION * frame_id:06.3f}" for frame_id in frame_ids])
+
+    columns = {
+        "gameId": per_play(week_plays["gameId"].to_numpy()),
+        "playId": per_play(week_plays["playId"].to_numpy()),
+        "nflId": per_entity(week_players["nflId"].to_numpy(), -1),
+        "displayName": per_entity(week_players["displayName"].to_numpy(), "football"),
+        "frameId": per_frame(frame_ids),
+        "frameType": per_frame(frame_type),
+        "time": per_frame(frame_time),
+        "jerseyNumber": per_entity(player_index + 1, -1),
+        "club": per_entity(week_players["club"].to_numpy(), "football"),
+        "playDirection": per_play(np.where(is_left, "left", "right")),
+        "x": x,
+        "y": y,
+        "s": speed,
+        "a": rng.uniform(0, 1, shape),
+        "dis": speed * Constants.FRAME_DURATION,
+        "o": rng.uniform(0, 360, shape),
+        "dir": rng.uniform(0, 360, shape),
+        "event": per_frame(play_events).astype(str),
+    }
+    # Rows ordered like the Kaggle files: by play, then entity, then frame, with the football last
+    tracking = pl.DataFrame({name: values.transpose(0, 2, 1).ravel() for name, values in columns.items()})
+
+    # The football has no id, jersey number, orientation or direction, and most frames have no event
+    is_football = pl.col("club") == "football"
+    return tracking.with_columns(
+        nflId=pl.when(is_football).then(None).otherwise(pl.col("nflId")),
+        jerseyNumber=pl.when(is_football).then(None).otherwise(pl.col("jerseyNumber")),
+        o=pl.when(is_football).then(None).otherwise(pl.col("o")),
+        dir=pl.when(is_football).then(None).otherwise(pl.col("dir")),
+        event=pl.when(pl.col("event") == "").then(None).otherwise(pl.col("event")),
+    ).select(TRACKING_COLUMNS)
+
+
+def generate_synthetic_data(out_dir: str,
+                            n_weeks: int = 2,
+                            games_per_week: int = 2,
+                            plays_per_game: int = 4,
+                            frames_per_play: int = 40,
+                            event_frames: dict = DEFAULT_EVENT_FRAMES,
+                            missing_event_rate: float = 0.0,
+                            seed: int = 0) -> dict:
+    """
+    Write games.csv, plays.csv, players.csv, player_play.csv and tracking_week_{week}.csv to out_dir,
+    with the columns, missing value markers ("NA") and row order of the Kaggle files. event_frames maps
+    each event to the frameId it is tagged on in every play, and missing_event_rate is the share of
+    plays without a line_set event.
+
+    Returns the file paths, keyed like the arguments of BigDataBowlData.
+
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    teams = TEAM_ABBREVIATIONS.categories.to_list()
+
+    players = _generate_players(teams)
+    games = _generate_games(teams, n_weeks, games_per_week)
+    plays = _generate_plays(rng, games, plays_per_game)
+    play_players = _get_team_players(plays, players, teams)
+
+    file_paths = {
+        "games_file_path": os.path.join(out_dir, "games.csv"),
+        "plays_file_path": os.path.join(out_dir, "plays.csv"),
+        "player_file_path": os.path.join(out_dir, "players.csv"),
+        "player_plays_file_path": os.path.join(out_dir, "player_play.csv"),
+        "tracking_data_file_paths": [os.path.join(out_dir, f"tracking_week_{week}.csv") for week in range(1, n_weeks + 1)],
+    }
+
+    games.write_csv(file_paths["games_file_path"])
+    plays.drop("week").write_csv(file_paths["plays_file_path"], null_value="NA")
+    players.write_csv(file_paths["player_file_path"])
+    _generate_player_play(rng, play_players).write_csv(file_paths["player_plays_file_path"], null_value="NA")
+
+    for week, tracking_file_path in zip(range(1, n_weeks + 1), file_paths["tracking_data_file_paths"]):
+        is_week = pl.col("week") == week
+        _generate_week_tracking(rng, plays.filter(is_week), play_players.filter(is_week), frames_per_play, event_frames, missing_event_rate).\
+            write_csv(tracking_file_path, null_value="NA")
+
+    return file_paths
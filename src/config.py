@@ -7,4 +7,7 @@ class Constants:
     Y_MAX = 160/3
     TEAM_COLOUR_1 = "red"
     TEAM_COLOUR_2 = "green"
-    BALL_COLOUR = "brown"
\ No newline at end of file
+    BALL_COLOUR = "brown"
+    PLAYERS_PER_TEAM = 11
+    # Tracking is recorded at 10 frames per second
+    FRAME_DURATION = 0.1
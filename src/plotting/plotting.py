@@ -1,10 +1,17 @@
 # Plotting functions for tracking data
+import os
+import time
+import logging
 import polars as pl
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import matplotlib.animation as animation
 from IPython.display import HTML
 from config import Constants
+from preprocessing.play_tensor import PlayTensor
+from preprocessing.play_index import PlayIndex
+from preprocessing.parallel import shared_frame_pool, read_shared_frames
 
 class PlotPlay():
     def __init__(self, 
@@ -25,29 +32,31 @@ class PlotPlay():
         self.colour2 = colour2
         self.ball_colour = ball_colour
         self.fig, self.ax = plt.subplots()
-        self.frame_ids = play_df.select(pl.col("frameId").unique().sort()).to_series().to_list()
         self.event_text = None
-        self.last_valid_event = None
         plt.close()
 
-    def _get_play_frame(self, frame_id):
-        return self.play_df.filter(pl.col("frameId") == frame_id)
-    
+        # Index the play by frame once, so drawing a frame is only array indexing
+        self.play_tensor = next(iter(PlayTensor.from_tracking(play_df).values()))
+        self.frame_ids = self.play_tensor.frame_ids.tolist()
+        self.frame_index = {frame_id: i for i, frame_id in enumerate(self.frame_ids)}
+        self.latest_events = self._get_latest_events()
+        self.team_colours = self._create_team_colours_dict()
+        self.club_masks = {club: self.play_tensor.clubs == club for club in self.team_colours}
+        self.jersey_numbers = self._get_jersey_numbers()
+
+    def _get_frame_positions(self, frame_id):
+        return self.play_tensor.values[self.frame_index[frame_id], :, :2]
+
+    def _get_latest_events(self):
+        # The latest event at or before every frame, carried forward through frames without one
+        return self.play_df.\
+            group_by("frameId").\
+            agg(pl.col("event").filter(pl.col("event").is_not_null() & (pl.col("event") != "NA")).last()).\
+            sort("frameId").\
+            select(pl.col("event").forward_fill())["event"].to_list()
+
     def _get_latest_event(self, frame_id):
-        # Get all events up to current frame
-        events = (self.play_df
-                .filter(pl.col("frameId") <= frame_id)
-                .filter(pl.col("event").is_not_null())
-                .filter(pl.col("event") != "NA")  # Filter out NA events
-                .select("frameId", "event")
-                .sort("frameId"))
-        
-        # Return the latest event if any exists
-        if len(events) > 0:
-            latest_event = events.tail(1)["event"][0]
-            self.last_valid_event = latest_event  # Update the last valid event
-            return latest_event
-        return self.last_valid_event  # Return the last valid event if no new event
+        return self.latest_events[self.frame_index[frame_id]]
         
     def _create_team_colours_dict(self):
         unique_teams = self.play_df.filter(pl.col("club") != "football").select(pl.col("club").unique()).sort("club")
@@ -57,34 +66,61 @@ class PlotPlay():
             "football": self.ball_colour
         }
         return team_colours
+
+    def _get_jersey_numbers(self):
+        jersey_numbers = dict(self.play_df.filter(pl.col("club") != "football").select("nflId", "jerseyNumber").unique().iter_rows())
+        return [str(jersey_numbers.get(nfl_id, "")) for nfl_id in self.play_tensor.nfl_ids]
     
     def _plot_field(self):
         pass
 
-    def _plot_players_for_frame(self, frame_id):
+    def _get_plot_coordinates(self, positions):
         pass
 
+    def _create_frame_artists(self):
+        # Created once per figure, then only their positions and text change from frame to frame
+        self.team_scatters = {
+            club: self.ax.scatter(np.empty(0), np.empty(0), color=colour, s=75, zorder=3)
+            for club, colour in self.team_colours.items() if club != "football"
+        }
+        self.ball_scatter = self.ax.scatter(np.empty(0), np.empty(0), color=self.ball_colour, s=50, zorder=3)
+
+        self.jersey_texts = [
+            self.ax.text(0, 0, jersey_number, fontsize=8, ha='center', va='center', zorder=4, clip_on=True, visible=False)
+            if club != "football" else None
+            for jersey_number, club in zip(self.jersey_numbers, self.play_tensor.clubs)
+        ]
+
+        self.event_text = self.ax.text(
+            # position below the field
+            0.5, -0.05,
+            "",
+            transform=self.ax.transAxes,  # Use axis coordinates
+            ha='center',
+            va='bottom',
+            fontsize=12,
+        )
+
+    def _get_frame_artists(self):
+        return [*self.team_scatters.values(), self.ball_scatter, *[text for text in self.jersey_texts if text is not None], self.event_text]
+
+    def _plot_players_for_frame(self, frame_id):
+        positions = self._get_plot_coordinates(self._get_frame_positions(frame_id))
+
+        for club, scatter in self.team_scatters.items():
+            scatter.set_offsets(positions[self.club_masks[club]])
+        self.ball_scatter.set_offsets(positions[self.club_masks["football"]])
+
+        # Players missing from the frame have NaN positions
+        for text, position in zip(self.jersey_texts, positions):
+            if text is not None:
+                text.set_position(position)
+                text.set_visible(not np.isnan(position).any())
+
+        return self._get_frame_artists()
+
     def _plot_event(self, event):
-        # Remove old event text if it exists
-        if self.event_text:
-            try:
-                self.event_text.remove()
-            except:
-                pass  # Text may have already been cleared by ax.clear()
-            self.event_text = None
-        
-        if event:
-            # Add new event text at top of plot
-            self.event_text = self.ax.text(
-                # 0.5, 1.05,  # Position above the field
-                # position below the field
-                0.5, -0.05,
-                f"Latest event: {event.title()}",
-                transform=self.ax.transAxes,  # Use axis coordinates
-                ha='center',
-                va='bottom',
-                fontsize=12,
-            )
+        self.event_text.set_text(f"Latest event: {event.title()}" if event else "")
 
     def plot_frame(self, frame_id):
         # Reset the figure
@@ -92,6 +128,7 @@ class PlotPlay():
         plt.close()
 
         self._plot_field()
+        self._create_frame_artists()
         self._plot_players_for_frame(frame_id)
         
         event = self._get_latest_event(frame_id)
@@ -101,22 +138,26 @@ class PlotPlay():
         return self.fig
 
     def _init_animation(self):
-        self.ax.clear()
-        self._plot_field()
+        # The field is drawn once before the animation starts, so only the moving artists are reset here
+        for scatter in [*self.team_scatters.values(), self.ball_scatter]:
+            scatter.set_offsets(np.empty((0, 2)))
+        for text in self.jersey_texts:
+            if text is not None:
+                text.set_visible(False)
         self._plot_event(None)
-        return self.ax.collections + self.ax.texts + self.ax.patches
+        return self._get_frame_artists()
     
     def _animate_frame(self, frame_id):
-        self.ax.clear()
-        self._plot_field()
-        self._plot_players_for_frame(frame_id)
+        artists = self._plot_players_for_frame(frame_id)
         event = self._get_latest_event(frame_id)
         self._plot_event(event)
-        return []
+        return artists
     
     def animate_play(self, interval=100, save_path=None):
-        # Create new figure for animation
+        # Create new figure for animation, with the field and player artists drawn once
         self.fig, self.ax = plt.subplots()
+        self._plot_field()
+        self._create_frame_artists()
         
         # Create animation
         anim = animation.FuncAnimation(
@@ -128,13 +169,17 @@ class PlotPlay():
             blit=True
         )
         
-        # Save the animation if save_path is provided
+        # Save the animation if save_path is provided, skipping the second render to html
         if save_path:
             if save_path.endswith('.gif'):
                 anim.save(save_path, writer='pillow')
             elif save_path.endswith('.mp4'):
                 anim.save(save_path, writer='ffmpeg')
+            else:
+                plt.close()
+                raise ValueError(f"Can only save animations as .gif or .mp4, got {save_path}")
             plt.close()
+            return None
 
         plt.close()
         return HTML(anim.to_jshtml())
@@ -183,26 +228,8 @@ class PlotPlayHorizontal(PlotPlay):
 
         self.ax.axis('off')
 
-    def _plot_players_for_frame(self, frame_id):
-        # Get the frame df
-        frame_df = self._get_play_frame(frame_id)
-
-        # Add the players
-        players = frame_df.filter(pl.col("club") != "football")
-        football = frame_df.filter(pl.col("club") == "football")
-
-        team_colours = self._create_team_colours_dict()
-        
-        players = players.with_columns(
-            colours=pl.col("club").replace(team_colours)
-        )
-
-        for row in players.iter_rows(named=True):
-            self.ax.scatter(row["x"], row["y"], color=row["colours"], s=75, zorder=3)
-            self.ax.text(row["x"], row["y"], row["jerseyNumber"], fontsize=8, ha='center', va='center', zorder=4)
-
-        # Plot the ball
-        self.ax.scatter(football["x"][0], football["y"][0], color="brown", s=50, zorder=3)        
+    def _get_plot_coordinates(self, positions):
+        return positions
 
 class PlotPlayVertical(PlotPlay):
     def __init__(self, play_df):
@@ -246,24 +273,79 @@ class PlotPlayVertical(PlotPlay):
 
         self.ax.axis('off')
 
-    def _plot_players_for_frame(self, frame_id):
-        # Get the frame df
-        frame_df = self._get_play_frame(frame_id)
-
-        # Add the players
-        players = frame_df.filter(pl.col("club") != "football")
-        football = frame_df.filter(pl.col("club") == "football")
-
-        team_colours = self._create_team_colours_dict()
-        
-        players = players.with_columns(
-            colours=pl.col("club").replace(team_colours)
-        )
-
-        for row in players.iter_rows(named=True):
-            self.ax.scatter(row["y"], row["x"], color=row["colours"], s=75, zorder=3)
-            self.ax.text(row["y"], row["x"], row["jerseyNumber"], fontsize=8, ha='center', va='center', zorder=4, clip_on=True)
-
-        # Plot the football
-        self.ax.scatter(football["y"][0], football["x"][0], color="brown", s=50, zorder=3) 
-    
\ No newline at end of file
+    def _get_plot_coordinates(self, positions):
+        return positions[:, ::-1]
+
+
+RENDER_REPORT_SCHEMA = {
+    "gameId": pl.Int64,
+    "playId": pl.Int64,
+    "path": pl.String,
+    "render_seconds": pl.Float64,
+    "error": pl.String,
+}
+
+_render_worker_state = {}
+
+
+def render_plays(data, play_ids, out_dir, n_workers=None, plot_class=PlotPlayVertical, file_format="gif", interval=100):
+    """
+    Render the animation of each (gameId, playId) in play_ids to out_dir/{gameId}_{playId}.{file_format},
+    across a process pool using the Agg backend. The tracking for the plays is written once to an
+    Arrow IPC file, which each worker memory maps.
+
+    Returns a report with the path, render time and any error of every play.
+
+    """
+    n_workers = n_workers or os.cpu_count()
+    os.makedirs(out_dir, exist_ok=True)
+
+    plays = pl.DataFrame(play_ids, schema=["gameId", "playId"], orient="row")
+    tasks = [(game_id, play_id, os.path.join(out_dir, f"{game_id}_{play_id}.{file_format}"))
+             for game_id, play_id in plays.iter_rows()]
+
+    tracking = data.tracking_data.join(plays.lazy(), on=["gameId", "playId"], how="semi").collect()
+
+    if n_workers == 1:
+        # Render in this process with the tracking held locally, then restore the caller's backend
+        backend = plt.get_backend()
+        plt.switch_backend("Agg")
+        try:
+            tracking = PlayIndex(tracking)
+            results = [_render_play(tracking, plot_class, interval, *task) for task in tasks]
+        finally:
+            plt.switch_backend(backend)
+    else:
+        with shared_frame_pool({"tracking": tracking}, n_workers, _init_render_worker, (plot_class, interval)) as executor:
+            results = list(executor.map(_render_worker_play, *zip(*tasks)))
+
+    report = pl.DataFrame(results, schema=RENDER_REPORT_SCHEMA, orient="row")
+    logging.info(f"Rendered {report['error'].null_count()}/{len(report)} plays in {report['render_seconds'].sum():.1f}s of render time")
+    return report
+
+
+def _init_render_worker(paths, plot_class, interval):
+    plt.switch_backend("Agg")
+    _render_worker_state["tracking"] = PlayIndex(read_shared_frames(paths)["tracking"])
+    _render_worker_state["plot_class"] = plot_class
+    _render_worker_state["interval"] = interval
+
+
+def _render_worker_play(game_id, play_id, save_path):
+    return _render_play(_render_worker_state["tracking"], _render_worker_state["plot_class"], _render_worker_state["interval"],
+                        game_id, play_id, save_path)
+
+
+def _render_play(tracking, plot_class, interval, game_id, play_id, save_path):
+    start = time.perf_counter()
+    try:
+        play_df = tracking.get(game_id, play_id)
+        if play_df.is_empty():
+            raise ValueError(f"No tracking data for play {game_id}-{play_id}")
+        plot_class(play_df).animate_play(interval=interval, save_path=save_path)
+        error = None
+    except Exception as e:
+        save_path, error = None, f"{type(e).__name__}: {e}"
+    render_seconds = time.perf_counter() - start
+    logging.info(f"Rendered play {game_id}-{play_id} in {render_seconds:.2f}s")
+    return game_id, play_id, save_path, render_seconds, error
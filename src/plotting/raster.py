@@ -0,0 +1,200 @@
+# Render play animations straight to RGB arrays, for bulk clip generation without matplotlib per frame
+import shutil
+import subprocess
+import numpy as np
+import matplotlib.colors as mcolors
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+from .plotting import PlotPlay, PlotPlayHorizontal, PlotPlayVertical
+
+
+def _render_canvas(fig):
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())
+
+
+def _get_disc_offsets(size, dpi):
+    # Pixel offsets covering a scatter marker of the given size in points^2, with an antialiased edge
+    radius = np.sqrt(size) / 2 * dpi / 72
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    alpha = np.clip(radius + 0.5 - np.sqrt(dx ** 2 + dy ** 2), 0, 1)
+    inside = alpha > 0
+    return dy[inside], dx[inside], alpha[inside]
+
+
+def _pack_colours(image):
+    # Each RGB pixel as one 24 bit integer
+    return image[..., 0].astype(np.uint32) << 16 | image[..., 1].astype(np.uint32) << 8 | image[..., 2]
+
+
+def _get_nearest_colours(packed_colours, palette):
+    # Index of the closest palette colour to each packed colour, from |c - p|^2 = |c|^2 - 2c.p + |p|^2
+    colours = np.stack([packed_colours >> 16, packed_colours >> 8 & 255, packed_colours & 255], axis=-1).astype(np.float32)
+    palette = palette.astype(np.float32)
+    return ((palette ** 2).sum(axis=-1) - 2 * colours @ palette.T).argmin(axis=-1)
+
+
+class RasterPlay(PlotPlay):
+    """
+    Mixin for PlotPlayHorizontal and PlotPlayVertical that draws the same layout into NumPy RGB
+    arrays. The field is rendered once by matplotlib, then every frame is a copy of that bitmap with
+    the players and ball stamped on as discs, and the jersey numbers and event text pasted from
+    pre-rendered masks.
+
+    """
+    dpi = 100
+
+    def _prepare_raster(self):
+        if getattr(self, "background", None) is not None:
+            return
+
+        self.fig = Figure(dpi=self.dpi)
+        self.ax = self.fig.add_subplot()
+        self._plot_field()
+        self.background = np.ascontiguousarray(_render_canvas(self.fig)[..., :3])
+        self.height = self.background.shape[0]
+
+        # Every entity's pixel position in every frame, in one transform
+        n_frames, n_entities, _ = self.play_tensor.values.shape
+        positions = self._get_plot_coordinates(self.play_tensor.values[..., :2].reshape(-1, 2))
+        pixels = self.ax.transData.transform(positions).reshape(n_frames, n_entities, 2)
+        self.pixel_columns = np.round(pixels[..., 0])
+        self.pixel_rows = np.round(self.height - pixels[..., 1])
+
+        self.entity_colours = np.array([mcolors.to_rgb(self.team_colours[club]) for club in self.play_tensor.clubs]) * 255
+        self.is_player = self.play_tensor.clubs != "football"
+        self.player_disc = _get_disc_offsets(75, self.dpi)
+        self.ball_disc = _get_disc_offsets(50, self.dpi)
+
+        event_x, event_y = self.ax.transAxes.transform((0.5, -0.05))
+        self.event_anchor = (int(round(self.height - event_y)), int(round(event_x)))
+        self.text_masks = {}
+
+    def _get_text_mask(self, text, fontsize):
+        # Alpha mask of the text, rendered once and reused for every frame it appears in
+        if (text, fontsize) not in self.text_masks:
+            fig = Figure(figsize=(len(text) * fontsize / 72 + 0.2, fontsize / 36), dpi=self.dpi)
+            fig.patch.set_alpha(0)
+            fig.text(0.5, 0.5, text, fontsize=fontsize, ha="center", va="center")
+            self.text_masks[(text, fontsize)] = _render_canvas(fig)[..., 3] / 255
+        return self.text_masks[(text, fontsize)]
+
+    def _paste_mask(self, image, mask, top, left, colour=(0, 0, 0)):
+        rows, columns = mask.shape
+        image_top, image_left = max(top, 0), max(left, 0)
+        image_bottom, image_right = min(top + rows, image.shape[0]), min(left + columns, image.shape[1])
+        if image_top >= image_bottom or image_left >= image_right:
+            return
+
+        alpha = mask[image_top - top:image_bottom - top, image_left - left:image_right - left, np.newaxis]
+        region = image[image_top:image_bottom, image_left:image_right]
+        region[:] = region * (1 - alpha) + np.asarray(colour) * alpha
+
+    def _stamp_discs(self, image, rows, columns, colours, disc):
+        # Every pixel of every disc at once, dropping entities that are missing or off the image
+        visible = ~(np.isnan(rows) | np.isnan(columns))
+        disc_rows = rows[visible, np.newaxis].astype(np.int64) + disc[0]
+        disc_columns = columns[visible, np.newaxis].astype(np.int64) + disc[1]
+        disc_colours = np.broadcast_to(colours[visible, np.newaxis], (*disc_rows.shape, 3))
+        disc_alpha = np.broadcast_to(disc[2], disc_rows.shape)
+
+        inside = (disc_rows >= 0) & (disc_rows < image.shape[0]) & (disc_columns >= 0) & (disc_columns < image.shape[1])
+        disc_rows, disc_columns, alpha = disc_rows[inside], disc_columns[inside], disc_alpha[inside, np.newaxis]
+        image[disc_rows, disc_columns] = image[disc_rows, disc_columns] * (1 - alpha) + disc_colours[inside] * alpha
+
+    def render_frame(self, frame_id):
+        self._prepare_raster()
+        frame_index = self.frame_index[frame_id]
+        rows, columns = self.pixel_rows[frame_index], self.pixel_columns[frame_index]
+
+        image = self.background.astype(np.float32)
+        self._stamp_discs(image, rows[self.is_player], columns[self.is_player], self.entity_colours[self.is_player], self.player_disc)
+        self._stamp_discs(image, rows[~self.is_player], columns[~self.is_player], self.entity_colours[~self.is_player], self.ball_disc)
+
+        for row, column, jersey_number in zip(rows[self.is_player], columns[self.is_player], np.array(self.jersey_numbers)[self.is_player]):
+            if not (np.isnan(row) or np.isnan(column)):
+                mask = self._get_text_mask(jersey_number, 8)
+                self._paste_mask(image, mask, int(row) - mask.shape[0] // 2, int(column) - mask.shape[1] // 2)
+
+        event = self._get_latest_event(frame_id)
+        if event:
+            mask = self._get_text_mask(f"Latest event: {event.title()}", 12)
+            top, centre = self.event_anchor
+            self._paste_mask(image, mask, top - mask.shape[0], centre - mask.shape[1] // 2)
+
+        return image.astype(np.uint8)
+
+    def render_frames(self):
+        for frame_id in self.frame_ids:
+            yield self.render_frame(frame_id)
+
+    def animate_play(self, interval=100, save_path=None):
+        """
+        Render every frame, then either return them as an array of shape (n_frames, height, width, 3)
+        or encode them to save_path (.gif with Pillow on one palette shared by every frame, .mp4 by piping
+        raw frames to ffmpeg).
+
+        """
+        if save_path is None:
+            return np.stack(list(self.render_frames()))
+
+        if save_path.endswith('.gif'):
+            # Pillow takes the frames one at a time, already on the shared palette, so it only keeps the
+            # changed region of each and never quantizes a frame itself
+            palette, field_indexes, field_colours = self._get_gif_palette()
+            frames = (self._to_gif_frame(frame, palette, field_indexes, field_colours) for frame in self.render_frames())
+            next(frames).save(save_path, save_all=True, append_images=frames, duration=interval, loop=0, optimize=False)
+        elif save_path.endswith('.mp4'):
+            self._encode_mp4(save_path, interval)
+        else:
+            raise ValueError(f"Can only save animations as .gif or .mp4, got {save_path}")
+        return None
+
+    def _get_gif_palette(self):
+        # One palette for every frame: the field's colours, plus the team colours and the black text drawn
+        # over it. Also returns the field as indexes into the palette, and as packed colours
+        self._prepare_raster()
+        overlay_colours = np.unique(np.vstack([self.entity_colours.round(), [0, 0, 0]]).astype(np.uint8), axis=0)
+        field = Image.fromarray(self.background).quantize(256 - len(overlay_colours), dither=Image.Dither.NONE)
+        palette = np.vstack([np.reshape(field.getpalette(), (-1, 3)), overlay_colours]).astype(np.uint8)
+        return palette, np.asarray(field), _pack_colours(self.background)
+
+    def _to_gif_frame(self, frame, palette, field_indexes, field_colours):
+        # Only the colours drawn over the field are matched to their nearest palette colour
+        indexes = field_indexes.copy()
+        frame_colours = _pack_colours(frame)
+        drawn = frame_colours != field_colours
+        colours, colour_indexes = np.unique(frame_colours[drawn], return_inverse=True)
+        indexes[drawn] = _get_nearest_colours(colours, palette)[colour_indexes]
+        image = Image.fromarray(indexes)
+        image.putpalette(palette.flatten().tolist())
+        return image
+
+    def _encode_mp4(self, save_path, interval):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg must be installed to save animations as .mp4")
+
+        self._prepare_raster()
+        height, width, _ = self.background.shape
+        encoder = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error",
+             "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(1000 / interval), "-i", "-",
+             # yuv420p needs even dimensions
+             "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", save_path],
+            stdin=subprocess.PIPE)
+        for frame in self.render_frames():
+            encoder.stdin.write(frame.tobytes())
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {save_path}")
+
+
+class RasterPlayHorizontal(RasterPlay, PlotPlayHorizontal):
+    pass
+
+
+class RasterPlayVertical(RasterPlay, PlotPlayVertical):
+    pass
@@ -0,0 +1,50 @@
+# Exact clustering of one dimensional player positions
+import numpy as np
+
+
+def cluster_1d_into_3_smallest_to_largest(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Optimal 1-D k-means with 3 clusters for a batch of samples with the same number of points.
+    In one dimension the optimal clusters are contiguous runs of the sorted values, so every
+    pair of split points is scored at once using prefix sums.
+
+    values has shape (n_samples, n_points). Returns the cluster centroids and counts, both of
+    shape (n_samples, 3), ordered from the smallest to the largest centroid.
+
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_samples, n_points = values.shape
+    if n_points < 3:
+        raise ValueError(f"Need at least 3 points to form 3 clusters, got {n_points}")
+
+    # Centre each sample to limit cancellation in the sum of squares
+    means = values.mean(axis=1, keepdims=True)
+    sorted_values = np.sort(values - means, axis=1)
+
+    zeros = np.zeros((n_samples, 1))
+    prefix_sum = np.concatenate([zeros, np.cumsum(sorted_values, axis=1)], axis=1)
+    prefix_sum_sq = np.concatenate([zeros, np.cumsum(sorted_values ** 2, axis=1)], axis=1)
+
+    # Clusters are [0, i), [i, j) and [j, n_points) for 1 <= i < j <= n_points - 1
+    i, j = np.triu_indices(n_points - 1, k=1)
+    i, j = i + 1, j + 1
+
+    def sum_of_squares(start, end):
+        total = prefix_sum[:, end] - prefix_sum[:, start]
+        total_sq = prefix_sum_sq[:, end] - prefix_sum_sq[:, start]
+        return total_sq - total ** 2 / (end - start)
+
+    inertia = sum_of_squares(np.zeros_like(i), i) + sum_of_squares(i, j) + sum_of_squares(j, np.full_like(j, n_points))
+    best = np.argmin(inertia, axis=1)
+    best_i, best_j = i[best], j[best]
+
+    rows = np.arange(n_samples)
+    counts = np.stack([best_i, best_j - best_i, n_points - best_j], axis=1)
+    sums = np.stack([
+        prefix_sum[rows, best_i],
+        prefix_sum[rows, best_j] - prefix_sum[rows, best_i],
+        prefix_sum[rows, n_points] - prefix_sum[rows, best_j],
+    ], axis=1)
+    centroids = sums / counts + means
+
+    return centroids, counts.astype(np.int64)
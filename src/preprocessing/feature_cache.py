@@ -0,0 +1,100 @@
+# Persist play features so only new or changed plays are recomputed
+import os
+import sys
+import hashlib
+import inspect
+import polars as pl
+from . import clustering, geometry, motion
+from .play_index import PLAY_KEYS
+
+
+class FeatureCache:
+    def __init__(self, cache_dir: str, frames: list[str] = ["line_set", "ball_snap"]) -> None:
+        """
+        Parquet store of the feature tables, one file per table, with a manifest of the
+        (gameId, playId, feature_version, input_fingerprint) of every cached play.
+
+        """
+        self.cache_dir = cache_dir
+        self.frames = frames
+
+    def get_feature_version(self, model) -> str:
+        # Any change to the feature code, or to the settings it runs with, invalidates the cache
+        sources = [inspect.getsource(sys.modules[type(model).__module__]),
+                   inspect.getsource(clustering),
+                   inspect.getsource(geometry),
+                   inspect.getsource(motion)]
+        settings = [pl.__version__, ",".join(self.frames), str(model.exact_clustering)]
+        return hashlib.sha256("\n".join(sources + settings).encode()).hexdigest()[:16]
+
+    def _fingerprint_rows(self, df: pl.DataFrame, name: str) -> pl.DataFrame:
+        # Categorical codes depend on the string cache, so hash their values instead
+        df = df.with_columns(pl.col(pl.Categorical).cast(pl.String))
+        return df.\
+            with_columns(row_hash=df.hash_rows()).\
+            group_by(PLAY_KEYS).\
+            agg(pl.col("row_hash").sum().alias(name))
+
+    def _fingerprint_plays(self, plays_df: pl.DataFrame, key_frame_tracking: dict) -> pl.DataFrame:
+        fingerprints = self._fingerprint_rows(plays_df, "play_df")
+        frame_names = [name for name in key_frame_tracking]
+        for name in frame_names:
+            fingerprints = fingerprints.join(self._fingerprint_rows(key_frame_tracking[name], name), on=PLAY_KEYS, how="left")
+
+        return plays_df.select(PLAY_KEYS).join(
+            fingerprints.select(*PLAY_KEYS, input_fingerprint=pl.struct(["play_df", *frame_names]).hash()),
+            on=PLAY_KEYS,
+            how="left")
+
+    def _get_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}.parquet")
+
+    def _read(self, name: str, feature_version: str) -> pl.DataFrame | None:
+        if not os.path.exists(self._get_path(name)):
+            return None
+        return pl.read_parquet(self._get_path(name)).filter(pl.col("feature_version") == feature_version)
+
+    def _write(self, name: str, df: pl.DataFrame) -> None:
+        # Write to a temporary file first so an interrupted run can't corrupt the cache
+        temp_path = self._get_path(name) + ".tmp"
+        df.write_parquet(temp_path)
+        os.replace(temp_path, self._get_path(name))
+
+    def get_feature_tables(self, model) -> dict:
+        feature_version = self.get_feature_version(model)
+        plays_df = model.data.plays_df
+        key_frame_tracking = model._get_key_frame_tracking(self.frames)
+
+        fingerprints = self._fingerprint_plays(plays_df, key_frame_tracking)
+        manifest = self._read("manifest", feature_version)
+        if manifest is None:
+            up_to_date = fingerprints.clear()
+        else:
+            up_to_date = fingerprints.join(manifest, on=[*PLAY_KEYS, "input_fingerprint"], how="semi")
+        stale = fingerprints.join(up_to_date, on=PLAY_KEYS, how="anti")
+
+        if stale.height > 0:
+            new_tables = model._compute_feature_tables(
+                plays_df.join(stale, on=PLAY_KEYS, how="semi"),
+                {frame: tracking.join(stale, on=PLAY_KEYS, how="semi") for frame, tracking in key_frame_tracking.items()},
+                self.frames)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name, table in new_tables.items():
+                table = table.with_columns(feature_version=pl.lit(feature_version))
+                cached_table = self._read(name, feature_version)
+                if cached_table is not None:
+                    table = pl.concat([cached_table.join(up_to_date, on=PLAY_KEYS, how="semi"), table], how="vertical_relaxed")
+                self._write(name, table)
+
+            self._write("manifest", fingerprints.with_columns(feature_version=pl.lit(feature_version)))
+
+        # The table names depend on the frames, so take them from an empty run of the feature code
+        empty_tables = model._compute_feature_tables(plays_df.clear(), {frame: tracking.clear() for frame, tracking in key_frame_tracking.items()}, self.frames)
+
+        tables = {}
+        for name in empty_tables:
+            tables[name] = fingerprints.select(PLAY_KEYS).\
+                join(self._read(name, feature_version), on=PLAY_KEYS, how="inner").\
+                drop("feature_version")
+        return tables
@@ -0,0 +1,59 @@
+# Batched geometry for player formations
+import numpy as np
+
+
+def _monotone_chain(sorted_points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Build one half of the hull for every sample at once, popping points that don't make a left turn
+    n_samples, n_points, _ = sorted_points.shape
+    rows = np.arange(n_samples)
+    chain = np.zeros_like(sorted_points)
+    chain_size = np.zeros(n_samples, dtype=np.int64)
+
+    for k in range(n_points):
+        point = sorted_points[:, k]
+        while True:
+            a = chain[rows, np.maximum(chain_size - 2, 0)]
+            b = chain[rows, np.maximum(chain_size - 1, 0)]
+            cross = (b[:, 0] - a[:, 0]) * (point[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (point[:, 0] - a[:, 0])
+            pop = (chain_size >= 2) & (cross <= 0)
+            if not pop.any():
+                break
+            chain_size -= pop
+        chain[rows, chain_size] = point
+        chain_size += 1
+
+    return chain, chain_size
+
+
+def _chain_perimeter_and_shoelace(chain: np.ndarray, chain_size: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    start, end = chain[:, :-1], chain[:, 1:]
+    is_edge = np.arange(chain.shape[1] - 1) < (chain_size - 1)[:, np.newaxis]
+
+    edge_length = np.sqrt(np.sum((end - start) ** 2, axis=-1))
+    shoelace = start[..., 0] * end[..., 1] - end[..., 0] * start[..., 1]
+
+    return np.sum(edge_length, axis=1, where=is_edge), np.sum(shoelace, axis=1, where=is_edge)
+
+
+def convex_hull_perimeter_and_area(points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convex hull perimeter and area for a batch of formations with the same number of players,
+    using Andrew's monotone chain vectorised across the batch.
+
+    points has shape (n_samples, n_points, 2). Collinear or repeated points give a degenerate
+    hull (perimeter of twice the segment length, zero area) instead of raising like scipy's
+    ConvexHull.
+
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 2:
+        points = points[np.newaxis]
+
+    # Sort each sample by x, then y
+    order = np.lexsort((points[..., 1], points[..., 0]), axis=-1)
+    sorted_points = np.take_along_axis(points, order[..., np.newaxis], axis=1)
+
+    lower_perimeter, lower_shoelace = _chain_perimeter_and_shoelace(*_monotone_chain(sorted_points))
+    upper_perimeter, upper_shoelace = _chain_perimeter_and_shoelace(*_monotone_chain(sorted_points[:, ::-1]))
+
+    return lower_perimeter + upper_perimeter, 0.5 * (lower_shoelace + upper_shoelace)
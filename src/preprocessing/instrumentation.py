@@ -0,0 +1,148 @@
+# Opt-in timing spans, row and memory counters, and query profiles for finding where a run spends its time
+import json
+import time
+import functools
+import contextlib
+import polars as pl
+
+
+# Returned by span() while disabled, so an instrumented block costs one function call
+_DISABLED_SPAN = contextlib.nullcontext()
+
+
+class Instrumentation:
+    def __init__(self) -> None:
+        """
+        Collects named, nested timing spans, with the rows and estimated bytes of the frames each
+        span produced, and the Polars profile of every lazy query collected through collect().
+        Disabled by default.
+
+        """
+        self.enabled = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.spans = {}
+        self.profiles = {}
+        self._stack = []
+
+    def _get_span_stats(self, path: str) -> dict:
+        if path not in self.spans:
+            self.spans[path] = {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "rows": 0, "bytes": 0}
+        return self.spans[path]
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield path
+        finally:
+            seconds = time.perf_counter() - start
+            self._stack.pop()
+            stats = self._get_span_stats(path)
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _DISABLED_SPAN
+        return self._span(name)
+
+    def record_frame(self, df: pl.DataFrame) -> pl.DataFrame:
+        # Count the rows and memory of a frame against the current span
+        if self.enabled and self._stack:
+            stats = self._get_span_stats("/".join(self._stack))
+            stats["rows"] += df.height
+            stats["bytes"] += df.estimated_size()
+        return df
+
+    def collect(self, name: str, lazy_frame: pl.LazyFrame) -> pl.DataFrame:
+        """
+        Collect a lazy query, in a span called name. While enabled the query is run with
+        LazyFrame.profile() and the time spent in each node of the plan is kept.
+
+        """
+        if not self.enabled:
+            return lazy_frame.collect()
+
+        with self._span(name) as path:
+            df, profile = lazy_frame.profile()
+            self.profiles.setdefault(path, []).append(profile)
+            return self.record_frame(df)
+
+    def timed(self, name: str):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self) -> pl.DataFrame:
+        return pl.DataFrame(
+            [{"span": path, **stats, "mean_seconds": stats["total_seconds"] / stats["calls"]} for path, stats in self.spans.items()],
+            schema={"span": pl.String, "calls": pl.Int64, "total_seconds": pl.Float64, "max_seconds": pl.Float64,
+                    "rows": pl.Int64, "bytes": pl.Int64, "mean_seconds": pl.Float64},
+        ).select("span", "calls", "total_seconds", "mean_seconds", "max_seconds", "rows", "bytes")
+
+    def report_json(self, path: str = None) -> dict:
+        """
+        The span report, plus the summed time in each node of every profiled query, as a dict.
+        Also written to path as JSON if given.
+
+        """
+        profiles = {}
+        for span_path, span_profiles in self.profiles.items():
+            node_seconds = pl.concat(span_profiles).\
+                group_by("node", maintain_order=True).\
+                agg(seconds=((pl.col("end") - pl.col("start")).sum() / 1e6))
+            profiles[span_path] = node_seconds.to_dicts()
+
+        report = {"spans": self.report().to_dicts(), "query_profiles": profiles}
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+
+instrumentation = Instrumentation()
+
+
+def enable() -> None:
+    instrumentation.enabled = True
+
+
+def disable() -> None:
+    instrumentation.enabled = False
+
+
+def reset() -> None:
+    instrumentation.reset()
+
+
+def span(name: str):
+    return instrumentation.span(name)
+
+
+def record_frame(df: pl.DataFrame) -> pl.DataFrame:
+    return instrumentation.record_frame(df)
+
+
+def collect(name: str, lazy_frame: pl.LazyFrame) -> pl.DataFrame:
+    return instrumentation.collect(name, lazy_frame)
+
+
+def timed(name: str):
+    return instrumentation.timed(name)
+
+
+def report() -> pl.DataFrame:
+    return instrumentation.report()
+
+
+def report_json(path: str = None) -> dict:
+    return instrumentation.report_json(path)
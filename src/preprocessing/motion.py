@@ -0,0 +1,107 @@
+# Pre-snap motion features over every frame between line_set and ball_snap, for all plays at once
+import polars as pl
+from config import Constants
+from .play_index import PLAY_KEYS
+
+
+# Speed in yards per second above which a player counts as in motion, here and in the in_motion formation feature
+IN_MOTION_SPEED = 0.6
+
+MOTION_FEATURES = ["path_length", "max_speed", "time_in_motion", "players_in_motion", "net_displacement", "max_net_displacement", "zone_transitions"]
+
+
+def assign_location_zones(tracking, x_los, x_first_down_marker):
+    """
+    Split the field into zones A-D across its width and 1-4 along its length, relative to the line of
+    scrimmage and the first down marker. x_los and x_first_down_marker can be numbers or expressions,
+    so the same zones are used for a single play and for a whole season.
+
+    """
+    Y_DIVIDER_1 = 12
+    Y_DIVIDER_2 = Constants.Y_MAX / 2
+    Y_DIVIDER_3 = Constants.Y_MAX - 12
+
+    X_DIVIDER_1 = x_los - 3
+    X_DIVIDER_2 = x_los
+    X_DIVIDER_3 = x_first_down_marker
+
+    return tracking.with_columns(
+        y_zone = pl.when(pl.col("y") <= Y_DIVIDER_1).then(pl.lit("A")).\
+                    when(pl.col("y") <= Y_DIVIDER_2).then(pl.lit("B")).\
+                    when(pl.col("y") <= Y_DIVIDER_3).then(pl.lit("C")).\
+                    otherwise(pl.lit("D")),
+        x_zone = pl.when(pl.col("x") <= X_DIVIDER_1).then(pl.lit("1")).\
+                    when(pl.col("x") <= X_DIVIDER_2).then(pl.lit("2")).\
+                    when(pl.col("x") <= X_DIVIDER_3).then(pl.lit("3")).\
+                    otherwise(pl.lit("4"))).\
+        with_columns(
+            zone_location = pl.concat_str(["y_zone", "x_zone"], separator="")
+        )
+
+
+def _get_pre_snap_window(tracking):
+    # First line_set and ball_snap frame of each play, and the line of scrimmage at line_set
+    key_frames = tracking.\
+        filter(pl.col("event").is_in(["line_set", "ball_snap"])).\
+        group_by(PLAY_KEYS).\
+        agg(line_set_frame=pl.col("frameId").filter(pl.col("event") == "line_set").min(),
+            ball_snap_frame=pl.col("frameId").filter(pl.col("event") == "ball_snap").min()).\
+        drop_nulls()
+
+    los = tracking.\
+        filter(pl.col("club") == "football").\
+        join(key_frames, on=PLAY_KEYS, how="inner").\
+        filter(pl.col("frameId") == pl.col("line_set_frame")).\
+        select(*PLAY_KEYS, x_los=pl.col("x"))
+
+    return key_frames.join(los, on=PLAY_KEYS, how="inner")
+
+
+def compute_pre_snap_motion_features(tracking, plays_df):
+    """
+    Motion of the offense and defense from line_set to ball_snap, one row per play.
+
+    tracking must have the offense/defense team labels. Each player's path length, max speed, time in
+    motion, net displacement and number of zone transitions are computed in one group by over every
+    player in every play, then summed (or maxed) by team.
+
+    """
+    tracking = tracking.lazy()
+    window = _get_pre_snap_window(tracking).\
+        join(plays_df.lazy().select(*PLAY_KEYS, "yardsToGo"), on=PLAY_KEYS, how="inner").\
+        with_columns(x_first_down_marker=pl.col("x_los") + pl.col("yardsToGo"))
+
+    pre_snap_tracking = tracking.\
+        filter(pl.col("team") != "football").\
+        join(window, on=PLAY_KEYS, how="inner").\
+        filter(pl.col("frameId").is_between(pl.col("line_set_frame"), pl.col("ball_snap_frame")))
+    pre_snap_tracking = assign_location_zones(pre_snap_tracking, pl.col("x_los"), pl.col("x_first_down_marker"))
+
+    x, y = pl.col("x").sort_by("frameId"), pl.col("y").sort_by("frameId")
+    zone = pl.col("zone_location").sort_by("frameId")
+    player_motion = pre_snap_tracking.\
+        group_by([*PLAY_KEYS, "nflId", "team"]).\
+        agg(path_length=((x.diff() ** 2 + y.diff() ** 2) ** 0.5).sum(),
+            max_speed=pl.col("s").max(),
+            time_in_motion=(pl.col("s") > IN_MOTION_SPEED).sum() * Constants.FRAME_DURATION,
+            net_displacement=((x.last() - x.first()) ** 2 + (y.last() - y.first()) ** 2) ** 0.5,
+            zone_transitions=(zone != zone.shift()).sum())
+
+    team_motion = player_motion.\
+        group_by([*PLAY_KEYS, "team"]).\
+        agg(path_length=pl.col("path_length").sum(),
+            max_speed=pl.col("max_speed").max(),
+            time_in_motion=pl.col("time_in_motion").sum(),
+            players_in_motion=(pl.col("time_in_motion") > 0).sum(),
+            net_displacement=pl.col("net_displacement").sum(),
+            max_net_displacement=pl.col("net_displacement").max(),
+            zone_transitions=pl.col("zone_transitions").sum())
+
+    plays = window.select(PLAY_KEYS)
+    for team in ["offense", "defense"]:
+        plays = plays.join(
+            team_motion.filter(pl.col("team") == team).select(*PLAY_KEYS, *[pl.col(feature).alias(f"{team}_{feature}") for feature in MOTION_FEATURES]),
+            on=PLAY_KEYS,
+            how="left")
+
+    return plays.sort(PLAY_KEYS)
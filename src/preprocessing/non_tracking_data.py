@@ -1,19 +1,105 @@
 import polars as pl
 
+
+# Fixed categories, so team columns from different files can be compared and joined
+TEAM_ABBREVIATIONS = pl.Enum([
+    "ARI", "ATL", "BAL", "BUF", "CAR", "CHI", "CIN", "CLE", "DAL", "DEN", "DET", "GB", "HOU", "IND", "JAX", "KC",
+    "LA", "LAC", "LV", "MIA", "MIN", "NE", "NO", "NYG", "NYJ", "PHI", "PIT", "SEA", "SF", "TB", "TEN", "WAS",
+])
+
+# Declared dtypes for the columns used in the pipeline, other columns are inferred from the whole file.
+# Team columns are read as strings and cast to TEAM_ABBREVIATIONS after loading.
+GAMES_SCHEMA = {
+    "gameId": pl.Int64,
+    "season": pl.Int64,
+    "week": pl.Int64,
+    "gameDate": pl.String,
+    "gameTimeEastern": pl.String,
+    "homeTeamAbbr": pl.String,
+    "visitorTeamAbbr": pl.String,
+    "homeFinalScore": pl.Int64,
+    "visitorFinalScore": pl.Int64,
+}
+
+PLAYS_SCHEMA = {
+    "gameId": pl.Int64,
+    "playId": pl.Int64,
+    "playDescription": pl.String,
+    "quarter": pl.Int64,
+    "down": pl.Int64,
+    "yardsToGo": pl.Int64,
+    "possessionTeam": pl.String,
+    "defensiveTeam": pl.String,
+    "yardlineSide": pl.String,
+    "yardlineNumber": pl.Int64,
+    "gameClock": pl.String,
+    "preSnapHomeScore": pl.Int64,
+    "preSnapVisitorScore": pl.Int64,
+    "preSnapHomeTeamWinProbability": pl.Float64,
+    "preSnapVisitorTeamWinProbability": pl.Float64,
+    "expectedPoints": pl.Float64,
+    "offenseFormation": pl.Categorical,
+    "receiverAlignment": pl.Categorical,
+    "passResult": pl.Categorical,
+    "playAction": pl.Boolean,
+    "dropbackType": pl.Categorical,
+    "passLocationType": pl.Categorical,
+    "rushLocationType": pl.Categorical,
+    "homeTeamWinProbabilityAdded": pl.Float64,
+    "visitorTeamWinProbilityAdded": pl.Float64,
+    "expectedPointsAdded": pl.Float64,
+    "isDropback": pl.Boolean,
+    "pff_runConceptPrimary": pl.Categorical,
+    "pff_runConceptSecondary": pl.Categorical,
+    "pff_passCoverage": pl.Categorical,
+    "pff_manZone": pl.Categorical,
+}
+
+PLAYERS_SCHEMA = {
+    "nflId": pl.Int64,
+    "height": pl.String,
+    "weight": pl.Int64,
+    "birthDate": pl.Date,
+    "collegeName": pl.String,
+    "position": pl.Categorical,
+    "displayName": pl.String,
+}
+
+PLAYER_PLAY_SCHEMA = {
+    "gameId": pl.Int64,
+    "playId": pl.Int64,
+    "nflId": pl.Int64,
+    "teamAbbr": pl.String,
+    "wasTargettedReceiver": pl.Int64,
+    "yardageGainedAfterTheCatch": pl.Int64,
+    "inMotionAtBallSnap": pl.Boolean,
+    "shiftSinceLineset": pl.Boolean,
+    "motionSinceLineset": pl.Boolean,
+    "routeRan": pl.Categorical,
+    "pff_defensiveCoverageAssignment": pl.Categorical,
+}
+
+TEAM_COLUMNS = ["homeTeamAbbr", "visitorTeamAbbr", "possessionTeam", "defensiveTeam", "yardlineSide", "teamAbbr"]
+
+
 class NonTrackingDataProcessor:
     def __init__(self, 
                  games_file_path: str,
                  plays_file_path: str,
                  player_file_path: str,
                  player_plays_file_path: str) -> None:
-        self.games = self.load_data(games_file_path)
-        self.plays = self.load_data(plays_file_path)
-        self.players = self.load_data(player_file_path)
-        self.player_plays = self.load_data(player_plays_file_path)
-
-    def load_data(self, file_path) -> pl.DataFrame:
-        data = pl.scan_csv(file_path, ignore_errors=True)
-        return data
+        self.games = self.load_data(games_file_path, GAMES_SCHEMA).\
+            with_columns(gameDate=pl.col("gameDate").str.to_date("%m/%d/%Y"),
+                         gameTimeEastern=pl.col("gameTimeEastern").str.to_time("%H:%M:%S"))
+        self.plays = self.load_data(plays_file_path, PLAYS_SCHEMA)
+        self.players = self.load_data(player_file_path, PLAYERS_SCHEMA)
+        self.player_plays = self.load_data(player_plays_file_path, PLAYER_PLAY_SCHEMA)
+
+    def load_data(self, file_path, schema=None) -> pl.DataFrame:
+        # Malformed values raise rather than silently becoming nulls
+        data = pl.scan_csv(file_path, schema_overrides=schema, null_values="NA", infer_schema_length=None)
+        team_columns = [column for column in TEAM_COLUMNS if column in (schema or {})]
+        return data.with_columns(pl.col(team_columns).cast(TEAM_ABBREVIATIONS))
     
     
     def _join_games_plays_df(self) -> pl.DataFrame:
@@ -28,18 +114,18 @@ class NonTrackingDataProcessor:
         """
         team_level_player_play_summary = self.player_plays.\
             with_columns(
-                playerHadMotionAndCameSet=((pl.col("motionSinceLineset") == "TRUE") | (pl.col("shiftSinceLineset") == "TRUE")),
-                playerHadPreSnapMotion=((pl.col("motionSinceLineset") == "TRUE") | (pl.col("shiftSinceLineset") == "TRUE") | (pl.col("inMotionAtBallSnap") == "TRUE"))).\
+                playerHadMotionAndCameSet=(pl.col("motionSinceLineset") | pl.col("shiftSinceLineset")),
+                playerHadPreSnapMotion=(pl.col("motionSinceLineset") | pl.col("shiftSinceLineset") | pl.col("inMotionAtBallSnap"))).\
             group_by(["gameId", "playId", "teamAbbr"]).\
-            agg(playNumPlayersInMotionAtSnap=(pl.col("inMotionAtBallSnap") == "TRUE").sum(),
-                playNumPlayersShiftSinceLineset=(pl.col("shiftSinceLineset") == "TRUE").sum(),
-                playNumPlayersMotionSinceLineset=(pl.col("motionSinceLineset") == "TRUE").sum(),
-                playNumPlayersHadMotionAndCameSet=(pl.col("playerHadMotionAndCameSet") == True).sum(),
-                playNumPlayersPreSnapMotion=(pl.col("playerHadPreSnapMotion") == True).sum(),
-                playerMotionCameSetWasTargetted=((pl.col("playerHadMotionAndCameSet") == True) & (pl.col("wasTargettedReceiver") == 1)).sum(),
-                playerInMotionAtSnapWasTargetted=((pl.col("inMotionAtBallSnap") == "TRUE") & (pl.col("wasTargettedReceiver") == 1)).sum(),
-                playerInMotionAtSnapRanRoute=((pl.col("inMotionAtBallSnap") == "TRUE") & (pl.col("routeRan") == "TRUE")).sum(),
-                playerPreSnapMotionWasTargetted=((pl.col("playerHadPreSnapMotion") == True) & (pl.col("wasTargettedReceiver") == 1)).sum(),
+            agg(playNumPlayersInMotionAtSnap=pl.col("inMotionAtBallSnap").sum(),
+                playNumPlayersShiftSinceLineset=pl.col("shiftSinceLineset").sum(),
+                playNumPlayersMotionSinceLineset=pl.col("motionSinceLineset").sum(),
+                playNumPlayersHadMotionAndCameSet=pl.col("playerHadMotionAndCameSet").sum(),
+                playNumPlayersPreSnapMotion=pl.col("playerHadPreSnapMotion").sum(),
+                playerMotionCameSetWasTargetted=(pl.col("playerHadMotionAndCameSet") & (pl.col("wasTargettedReceiver") == 1)).sum(),
+                playerInMotionAtSnapWasTargetted=(pl.col("inMotionAtBallSnap") & (pl.col("wasTargettedReceiver") == 1)).sum(),
+                playerInMotionAtSnapRanRoute=(pl.col("inMotionAtBallSnap") & pl.col("routeRan").is_not_null()).sum(),
+                playerPreSnapMotionWasTargetted=(pl.col("playerHadPreSnapMotion") & (pl.col("wasTargettedReceiver") == 1)).sum(),
                 yardsAfterCatch=pl.sum("yardageGainedAfterTheCatch"),
                 playNumTargetedReceivers=pl.sum("wasTargettedReceiver"),
                 ).\
@@ -99,11 +185,11 @@ class NonTrackingDataProcessor:
         # Create possession team features
         output_data = games_plays_joined.with_columns(
             # Extract time remaining
-            quarterSecondsRemaining=pl.col('gameClock').str.split(':').map_elements(lambda x: int(x[0]) * 60 + int(x[1]), return_dtype=pl.Int32),
+            quarterSecondsRemaining=(pl.col('gameClock').str.split(':').list.first().cast(pl.Int32) * 60 + pl.col('gameClock').str.split(':').list.last().cast(pl.Int32)),
             # Get distance to the endzone
             distanceToEndzone=pl.when(pl.col("possessionTeam") == pl.col("yardlineSide")).then(100 - pl.col("yardlineNumber")).otherwise(pl.col("yardlineNumber")),
             # Extract play type
-            playType=pl.when(pl.col("passResult") == "").then(pl.lit("run")).otherwise(pl.lit("pass")),
+            playType=pl.when(pl.col("passResult").is_null() | (pl.col("passResult") == "")).then(pl.lit("run")).otherwise(pl.lit("pass")),
             # Get pre snap scores
             preSnapPossessionTeamScore=pl.when(pl.col("possessionTeam") == pl.col("homeTeamAbbr")).then(pl.col("preSnapHomeScore")).otherwise(pl.col("preSnapVisitorScore")),
             preSnapDefensiveTeamScore=pl.when(pl.col("possessionTeam") == pl.col("homeTeamAbbr")).then(pl.col("preSnapVisitorScore")).otherwise(pl.col("preSnapHomeScore")),
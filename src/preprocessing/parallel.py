@@ -0,0 +1,32 @@
+# Process pools whose workers share frames through memory mapped Arrow IPC files
+import os
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import polars as pl
+
+
+@contextmanager
+def shared_frame_pool(frames: dict, n_workers: int, initializer, initargs: tuple = ()):
+    """
+    Write each of frames once to an Arrow IPC file, then yield a process pool whose workers each run
+    initializer(paths, *initargs), where paths maps the names in frames to their files. Workers open
+    them with read_shared_frames, which memory maps them rather than receiving a pickled copy per task.
+
+    """
+    with tempfile.TemporaryDirectory() as ipc_dir:
+        paths = {name: os.path.join(ipc_dir, f"{name}.arrow") for name in frames}
+        for name, frame in frames.items():
+            frame.write_ipc(paths[name])
+
+        # Polars is multithreaded, so workers are spawned rather than forked
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=initializer,
+                                 initargs=(paths, *initargs)) as executor:
+            yield executor
+
+
+def read_shared_frames(paths: dict) -> dict:
+    return {name: pl.read_ipc(path, memory_map=True) for name, path in paths.items()}
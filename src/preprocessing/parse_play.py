@@ -1,115 +1,142 @@
+import polars as pl
+from functools import cached_property
+from .motion import assign_location_zones
+
+
 class ParsedPlay:
-    def __init__(self, gameId, playId):
+    def __init__(self, data, gameId=None, playId=None):
+        """
+        Pre-snap analysis of a single play, from line_set onwards. data is either a BigDataBowlData,
+        in which case gameId and playId pick the play, or a play slice as returned by get_play_data.
+        Derived tables are computed on first access and then cached.
 
-        total_data = data.get_play_data(gameId, playId)
+        """
+        total_data = data if isinstance(data, dict) else data.get_play_data(gameId, playId)
 
         self.play_info = self._create_play_info_dict(total_data["play_df"])
-        self.tracking_df = total_data["tracking_df"]
+        tracking_df = total_data["tracking_df"]
+        self.tracking_df = tracking_df.collect() if isinstance(tracking_df, pl.LazyFrame) else tracking_df
         self.player_play_df = total_data["player_play_df"]
 
-        self.x_los, self.y_los = self._get_los_ball_placement()
-        self.x_first_down_marker = self._get_first_down_line()
-
         self.key_frames = self.get_key_event_frames()
         self.line_set_frame = self.key_frames["line_set"]
         self.ball_snap_frame = self.key_frames["ball_snap"]
         self.play_direction = self._get_original_play_direction()
 
-        self.processed_tracking_df = self.process_tracking_data(self.tracking_df)
+        self.x_los, self.y_los = self._get_los_ball_placement()
+        self.x_first_down_marker = self._get_first_down_line()
 
     def _create_play_info_dict(self, play_df):
         assert len(play_df) == 1, "DataFrame must have exactly one row"
         return play_df.to_dicts()[0]
-    
+
     def _get_team_tracking_data(self, team):
         return self.tracking_df.filter(pl.col("club") == team)
 
     def _get_los_ball_placement(self):
-        tracking_ball_lineset = self.tracking_df.filter((pl.col("club") == "football") & (pl.col("event") == "line_set"))
+        tracking_ball_lineset = self.tracking_df.filter((pl.col("club") == "football") & (pl.col("frameId") == self.line_set_frame))
         lineset_x = tracking_ball_lineset.select("x").item()
         lineset_y = tracking_ball_lineset.select("y").item()
         return lineset_x, lineset_y
-    
+
     def _get_original_play_direction(self):
         return self.tracking_df["playDirection"].item(0)
 
-    def _get_first_down_line(self): 
+    def _get_first_down_line(self):
         return self.x_los + self.play_info["yardsToGo"]
-    
+
+    @cached_property
+    def event_frames(self) -> dict:
+        # First frame of every event in the play, found in one pass
+        return dict(self.tracking_df.
+                    filter(pl.col("event").is_not_null()).
+                    group_by("event").
+                    agg(pl.col("frameId").min()).
+                    select(pl.col("event").cast(pl.String), "frameId").
+                    iter_rows())
+
     def _get_event_frame(self, event):
-        event_frame = self.tracking_df.filter(pl.col("event") == event).select("frameId").head(1)
-        if event_frame.is_empty():
+        if event not in self.event_frames:
             raise ValueError(f"No {event} event found in tracking data")
-        return event_frame.item()
+        return self.event_frames[event]
 
     def get_key_event_frames(self):
-        
-        self.line_set_frame = self._get_event_frame("line_set")
-        self.ball_snap_frame = self._get_event_frame("ball_snap")
-        
         return {
             "line_set": self._get_event_frame("line_set"),
             "ball_snap": self._get_event_frame("ball_snap"),
-            } 
-    
+            }
+
     def _filter_events_before_line_set(self, tracking_df):
         filtered_df = tracking_df.filter(pl.col("frameId") >= self.line_set_frame).\
             with_columns(adjusted_frame_id = pl.col("frameId") - self.line_set_frame + 1)
         return filtered_df
-    
+
     def _map_offense_and_defense_teams(self, tracking_df):
         possession_team = self.play_info["possessionTeam"]
         defensive_team = self.play_info["defensiveTeam"]
-        
+
         return tracking_df.with_columns(
             team = pl.when(pl.col("club") == possession_team).then(pl.lit("offense")).\
                       when(pl.col("club") == defensive_team).then(pl.lit("defense")).\
                       otherwise(pl.lit("football"))
         )
-        
-    def _assign_location_zones(self, tracking_df):
-        
-        Y_DIVIDER_1 = 12
-        Y_DIVIDER_2 = 160/6
-        Y_DIVIDER_3 = 160/3 - 12
-
-        X_DIVIDER_1 = self.x_los - 3
-        X_DIVIDER_2 = self.x_los
-        X_DIVIDER_3 = self.x_first_down_marker
 
-        return tracking_df.with_columns(
-            y_zone = pl.when(pl.col("y") <= Y_DIVIDER_1).then(pl.lit("A")).\
-                        when(pl.col("y") <= Y_DIVIDER_2).then(pl.lit("B")).\
-                        when(pl.col("y") <= Y_DIVIDER_3).then(pl.lit("C")).\
-                        otherwise(pl.lit("D")),
-            x_zone = pl.when(pl.col("x") <= X_DIVIDER_1).then(pl.lit("1")).\
-                        when(pl.col("x") <= X_DIVIDER_2).then(pl.lit("2")).\
-                        when(pl.col("x") <= X_DIVIDER_3).then(pl.lit("3")).\
-                        otherwise(pl.lit("4"))).\
-            with_columns(
-                zone_location = pl.concat_str(["y_zone", "x_zone"], separator="")
-            )
+    def _assign_location_zones(self, tracking_df):
+        return assign_location_zones(tracking_df, self.x_los, self.x_first_down_marker).\
+            with_columns(x_los = pl.lit(self.x_los),
+                         x_first_down_marker = pl.lit(self.x_first_down_marker))
 
     def process_tracking_data(self, tracking_df):
-        processed_tracking = self._map_offense_and_defense_teams(tracking_df)
+        # Filter first so the zones are only computed for the frames we keep
+        processed_tracking = self._filter_events_before_line_set(tracking_df)
+        processed_tracking = self._map_offense_and_defense_teams(processed_tracking)
         processed_tracking = self._assign_location_zones(processed_tracking)
-        processed_tracking = self._filter_events_before_line_set(processed_tracking)
         return processed_tracking
-    
-    def compute_team_centroids(self, tracking_frame):
-
-    
-    def analyse_play_motion(self, tracking_df):
-        lineset_tracking = tracking_df.filter(pl.col("frameId") == self.line_set_frame)
-        ball_snap_frame = tracking_df.filter(pl.col("frameId") == self.ball_snap_frame)
-
-    #     # TODO Filter out events before line_set 
-    #     # TODO Map offense and defense 
-    #     # # TODO create zones
-    #     # TODO Filter out events before line_set
-    #     # TODO Identify x, y centroids for offense, defense at line_set, ball_snap, etc.
-    #     # TODO Identify most common patterns of movement for players in each team. Identify if there is correlation between type of motion
-
-    # def analyse_play_motion(self):
-    #     # TODO Reutnr 
-        pass
\ No newline at end of file
+
+    @cached_property
+    def processed_tracking_df(self):
+        return self.process_tracking_data(self.tracking_df)
+
+    @cached_property
+    def team_centroids(self):
+        return self.compute_team_centroids(self.processed_tracking_df)
+
+    def compute_team_centroids(self, tracking_df):
+        """
+        x, y centroid and spread of the offense and defense in every frame of tracking_df.
+
+        """
+        return tracking_df.\
+            filter(pl.col("team") != "football").\
+            group_by(["frameId", "adjusted_frame_id", "team"]).\
+            agg(x_centroid=pl.col("x").mean(),
+                y_centroid=pl.col("y").mean(),
+                x_spread=pl.col("x").std(),
+                y_spread=pl.col("y").std()).\
+            sort(["frameId", "team"])
+
+    def analyse_play_motion(self, tracking_df=None):
+        """
+        Movement of each player between line_set and ball_snap: displacement, distance travelled,
+        and the zones they started and finished in.
+
+        """
+        if tracking_df is None:
+            tracking_df = self.processed_tracking_df
+
+        pre_snap_tracking = tracking_df.\
+            filter((pl.col("frameId") <= self.ball_snap_frame) & (pl.col("team") != "football")).\
+            sort(["nflId", "frameId"])
+
+        return pre_snap_tracking.\
+            group_by(["nflId", "team"], maintain_order=True).\
+            agg(x_line_set=pl.col("x").first(),
+                y_line_set=pl.col("y").first(),
+                x_ball_snap=pl.col("x").last(),
+                y_ball_snap=pl.col("y").last(),
+                distance_travelled=pl.col("dis").sum() - pl.col("dis").first(),
+                zone_line_set=pl.col("zone_location").first(),
+                zone_ball_snap=pl.col("zone_location").last()).\
+            with_columns(
+                displacement=((pl.col("x_ball_snap") - pl.col("x_line_set")) ** 2 + (pl.col("y_ball_snap") - pl.col("y_line_set")) ** 2).sqrt(),
+                zone_changed=pl.col("zone_line_set") != pl.col("zone_ball_snap"))
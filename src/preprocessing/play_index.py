@@ -0,0 +1,64 @@
+# Index frames by play so a single play can be sliced out without filtering the full frame
+import polars as pl
+
+
+# The columns that identify a play, in every frame of the pipeline
+PLAY_KEYS = ["gameId", "playId"]
+
+
+class PlayIndex:
+    def __init__(self, df: pl.DataFrame | pl.LazyFrame, keys: list[str] = PLAY_KEYS, is_sorted: bool = False) -> None:
+        """
+        Map each play to its (offset, length) in df. Eager frames are sorted by the keys first,
+        lazy frames must already be stored sorted by the keys (e.g. the parquet tracking store).
+
+        """
+        if isinstance(df, pl.DataFrame) and not is_sorted:
+            df = df.sort(keys, maintain_order=True)
+        self.df = df
+        self.keys = keys
+        self.offsets = self._build_offsets()
+
+    def _build_offsets(self) -> dict:
+        offsets = self.df.select(self.keys).\
+            with_row_index("offset").\
+            group_by(self.keys, maintain_order=True).\
+            agg(offset=pl.col("offset").first(),
+                length=pl.len(),
+                is_contiguous=(pl.col("offset").last() - pl.col("offset").first() + 1) == pl.len())
+
+        if isinstance(offsets, pl.LazyFrame):
+            offsets = offsets.collect()
+
+        if not offsets["is_contiguous"].all():
+            raise ValueError(f"Rows for each {self.keys} must be contiguous to build a PlayIndex")
+
+        return {
+            tuple(row[:-2]): (row[-2], row[-1])
+            for row in offsets.select([*self.keys, "offset", "length"]).iter_rows()
+        }
+
+    def append(self, df: pl.DataFrame | pl.LazyFrame) -> None:
+        """
+        Index the plays in df after the rows already indexed, without re-reading them.
+        None of the plays in df can already be in the index.
+
+        """
+        new_index = PlayIndex(df, self.keys)
+        if not self.offsets.keys().isdisjoint(new_index.offsets):
+            raise ValueError("Can only append plays that aren't already in the PlayIndex")
+
+        # Every row belongs to a play, so the current height is the sum of the play lengths
+        height = sum(length for _, length in self.offsets.values())
+        self.offsets.update({key: (offset + height, length) for key, (offset, length) in new_index.offsets.items()})
+        self.df = pl.concat([self.df, new_index.df])
+
+    def __contains__(self, key) -> bool:
+        return key in self.offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, *key) -> pl.DataFrame | pl.LazyFrame:
+        offset, length = self.offsets.get(key, (0, 0))
+        return self.df.slice(offset, length)
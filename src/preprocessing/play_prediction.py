@@ -1,17 +1,100 @@
+import os
 import polars as pl
 from .tracking_data import TrackingDataProcessor
 from .non_tracking_data import NonTrackingDataProcessor
 from .preprocessing import BigDataBowlData
 import numpy as np
-from scipy.spatial import ConvexHull
 from sklearn.cluster import KMeans
+from .clustering import cluster_1d_into_3_smallest_to_largest
+from .geometry import convex_hull_perimeter_and_area
+from .feature_cache import FeatureCache
+from .motion import compute_pre_snap_motion_features, IN_MOTION_SPEED
+from .play_index import PLAY_KEYS
+from .parallel import shared_frame_pool, read_shared_frames
+from . import instrumentation
+
+
+# Map the team-agnostic formation features onto the feature names used by the models
+OFFENSE_SPATIAL_FEATURE_NAMES = {
+    "x_centroid": "offense_x_centroid",
+    "x_rel_centroid": "offense_x_rel_centroid",
+    "y_centroid": "offense_y_centroid",
+    "depth": "offense_depth",
+    "width": "offense_width",
+    "in_tackle_box": "offense_in_box",
+    "left_side": "offense_left_side",
+    "right_side": "offense_right_side",
+    "in_motion": "offense_in_motion",
+    "average_speed": "offense_average_speed",
+    "hull_perimeter": "offense_hull_perimeter",
+    "hull_volume": "offense_hull_volume",
+    "x_cluster_0_centroid": "offense_depth_back_cluster_centroid",
+    "x_cluster_1_centroid": "offense_depth_middle_cluster_centroid",
+    "x_cluster_2_centroid": "offense_depth_front_cluster_centroid",
+    "y_cluster_0_centroid": "offense_width_left_cluster_centroid",
+    "y_cluster_1_centroid": "offense_width_middle_cluster_centroid",
+    "y_cluster_2_centroid": "offense_width_right_cluster_centroid",
+    "x_cluster_0_count": "offense_depth_back_cluster_count",
+    "x_cluster_1_count": "offense_depth_middle_cluster_count",
+    "x_cluster_2_count": "offense_depth_front_cluster_count",
+    "y_cluster_0_count": "offense_width_left_cluster_count",
+    "y_cluster_1_count": "offense_width_middle_cluster_count",
+    "y_cluster_2_count": "offense_width_right_cluster_count",
+}
+
+DEFENSE_SPATIAL_FEATURE_NAMES = {
+    "x_centroid": "defense_x_centroid",
+    "x_rel_centroid": "defense_x_rel_centroid",
+    "y_centroid": "defense_y_centroid",
+    "depth": "defense_depth",
+    "width": "defense_width",
+    "in_tackle_box": "defenders_in_box",
+    "left_side": "defenders_left_side",
+    "right_side": "defenders_right_side",
+    "in_motion": "defenders_in_motion",
+    "average_speed": "defense_average_speed",
+    "hull_perimeter": "defense_hull_perimeter",
+    "hull_volume": "defense_hull_volume",
+    "x_cluster_0_centroid": "defense_depth_front_cluster_centroid",
+    "x_cluster_1_centroid": "defense_depth_middle_cluster_centroid",
+    "x_cluster_2_centroid": "defense_depth_back_cluster_centroid",
+    "y_cluster_0_centroid": "defense_width_left_cluster_centroid",
+    "y_cluster_1_centroid": "defense_width_middle_cluster_centroid",
+    "y_cluster_2_centroid": "defense_width_right_cluster_centroid",
+    "x_cluster_0_count": "defense_depth_back_cluster_count",
+    "x_cluster_1_count": "defense_depth_middle_cluster_count",
+    "x_cluster_2_count": "defense_depth_front_cluster_count",
+    "y_cluster_0_count": "defense_width_left_cluster_count",
+    "y_cluster_1_count": "defense_width_middle_cluster_count",
+    "y_cluster_2_count": "defense_width_right_cluster_count",
+}
+
+FORMATION_SCHEMA = {
+    "hull_perimeter": pl.Float64,
+    "hull_volume": pl.Float64,
+    **{f"{axis}_cluster_{i}_centroid": pl.Float64 for axis in ["x", "y"] for i in range(3)},
+    **{f"{axis}_cluster_{i}_count": pl.Int64 for axis in ["x", "y"] for i in range(3)},
+}
+
+ERROR_SCHEMA = {
+    "gameId": pl.Int64,
+    "playId": pl.Int64,
+    "exception_type": pl.String,
+    "message": pl.String,
+}
+
+# Read-only inputs shared with each feature extraction worker, set once by _init_feature_worker
+_feature_worker_state = {}
 
 
 class PlayPredictionModel:
     def __init__(self, 
-                 data: BigDataBowlData) -> None:
+                 data: BigDataBowlData,
+                 exact_clustering: bool = True) -> None:
         
         self.data = data
+        # Set to False to fit the clusters with sklearn KMeans instead, e.g. for parity checks
+        self.exact_clustering = exact_clustering
 
     def _create_play_info_dict(self, play_df):
         assert len(play_df) == 1, "DataFrame must have exactly one row"
@@ -48,19 +131,35 @@ class PlayPredictionModel:
             "x_first_down_marker": x_first_down_marker
         }
     
-    def get_game_state_features(self, play_info):
+    def _table_row_to_dict(self, table, drop_keys=False):
+        assert len(table) == 1, "DataFrame must have exactly one row"
+        if drop_keys:
+            table = table.drop(PLAY_KEYS)
+        return table.to_dicts()[0]
+
+    def _compute_game_state_table(self, plays_df):
+        return plays_df.select(
+            "gameId",
+            "playId",
+            "quarter",
+            "down",
+            logYardsToGo=pl.col("yardsToGo").log(),
+            distanceToEndzone=pl.col("distanceToEndzone"),
+            scoreDifference=pl.col("scoreDifference"),
+            gameSecondsRemaining=pl.col("gameSecondsRemaining"),
+        )
+
+    def _compute_target_table(self, plays_df):
+        return plays_df.select(
+            "gameId",
+            "playId",
+            "playType",
+            isPass=(pl.col("playType") == "pass").cast(pl.Int32),
+            split=pl.when(pl.col("week") <= 6).then(pl.lit("train")).otherwise(pl.lit("test"))
+        )
 
-        features = {
-            "gameId": play_info["gameId"],
-            "playId": play_info["playId"],
-            "quarter": play_info["quarter"],
-            "down": play_info["down"],
-            "logYardsToGo": np.log(play_info["yardsToGo"]),
-            "distanceToEndzone": play_info["distanceToEndzone"],
-            "scoreDifference": play_info["scoreDifference"],
-            "gameSecondsRemaining": play_info["gameSecondsRemaining"],
-        }
-        return features
+    def get_game_state_features(self, play_info):
+        return self._table_row_to_dict(self._compute_game_state_table(pl.from_dicts([play_info])))
     
     
     def _cluster_into_3_smallest_to_largest(self, location_array):
@@ -94,153 +193,331 @@ class PlayPredictionModel:
             "cluster_2_count": label_counts[2]
         }
 
-    def compute_offense_spatial_features(self, play_data, offense_tracking):
-        offense_tracking = offense_tracking.\
-            with_columns(x_rel_los = pl.col("x") - play_data["x_los"],
-                        in_offensive_tackle_box = pl.when((pl.col("x") >= (play_data["x_los"] - 8)) & 
-                                                (pl.col("y") <= (play_data["y_los"] + 6)) & 
-                                                (pl.col("y") >= (play_data["y_los"] - 6))).then(1).otherwise(0),
-                        left_side = pl.when(pl.col("y") <= play_data["y_los"]).then(1).otherwise(0),
-                        right_side = pl.when(pl.col("y") >= play_data["y_los"]).then(1).otherwise(0),
-                        in_motion = pl.when(pl.col("s") > 0.6).then(1).otherwise(0))
-
-        x_centroid = offense_tracking["x"].mean()
-        x_rel_centroid = offense_tracking["x_rel_los"].mean()
-        y_centroid = offense_tracking["y"].mean()
-
-        offense_depth = offense_tracking["x"].max() - offense_tracking["x"].min()
-        offense_width = offense_tracking["y"].max() - offense_tracking["y"].min()
-
-        left_sided_offense = offense_tracking["left_side"].sum()
-        right_sided_offense = offense_tracking["right_side"].sum()
-        offense_in_box = offense_tracking["in_offensive_tackle_box"].sum()
-
-
-        players_in_motion = offense_tracking["in_motion"].sum()
-        average_speed = offense_tracking["s"].mean()
-
-        hull = ConvexHull(offense_tracking[["x", "y"]].to_numpy())
-        hull_perimeter = hull.area
-        hull_volume = hull.volume
-
-        x_clusters = self._cluster_into_3_smallest_to_largest(offense_tracking[["x_rel_los"]].to_numpy())
-        y_clusters = self._cluster_into_3_smallest_to_largest(offense_tracking[["y"]].to_numpy())
+    def _get_first_event_frame(self, key_frame_tracking):
+        # Keep only the first frame of an event, in case it was tagged more than once in a play
+        return key_frame_tracking.filter(pl.col("frameId") == pl.col("frameId").min().over(PLAY_KEYS))
+
+    def _get_line_of_scrimmage(self, line_set_tracking):
+        return line_set_tracking.\
+            filter(pl.col("club") == "football").\
+            select("gameId", "playId", x_los=pl.col("x"), y_los=pl.col("y"))
+
+    def _add_formation_indicators(self, tracking, los):
+        offense_tackle_box = (pl.col("x") >= (pl.col("x_los") - 8)) & \
+            (pl.col("y") <= (pl.col("y_los") + 6)) & \
+            (pl.col("y") >= (pl.col("y_los") - 6))
+        defense_tackle_box = (pl.col("x") <= (pl.col("x_los") + 5)) & \
+            (pl.col("y") <= (pl.col("y_los") + 4)) & \
+            (pl.col("y") >= (pl.col("y_los") - 4))
+
+        return tracking.\
+            filter(pl.col("team") != "football").\
+            join(los, on=PLAY_KEYS, how="inner").\
+            with_columns(x_rel_los = pl.col("x") - pl.col("x_los"),
+                         in_tackle_box = pl.when(pl.col("team") == "offense").then(offense_tackle_box).otherwise(defense_tackle_box).cast(pl.Int32),
+                         left_side = (pl.col("y") <= pl.col("y_los")).cast(pl.Int32),
+                         right_side = (pl.col("y") >= pl.col("y_los")).cast(pl.Int32),
+                         in_motion = (pl.col("s") > IN_MOTION_SPEED).cast(pl.Int32))
+
+    def _group_rows_by_team_size(self, positions):
+        # Batch together the teams with the same number of players, so they can be stacked into one array
+        lengths = positions.list.len().to_numpy()
+        for n_players in np.unique(lengths):
+            yield np.flatnonzero(lengths == n_players), int(n_players)
+
+    def _stack_positions(self, positions, rows, n_players):
+        return positions.gather(rows).list.to_array(n_players).to_numpy()
+
+    @instrumentation.timed("convex_hull")
+    def _compute_hulls(self, x_positions, y_positions):
+        perimeter = np.zeros(len(x_positions))
+        area = np.zeros(len(x_positions))
+
+        for rows, n_players in self._group_rows_by_team_size(x_positions):
+            points = np.stack([self._stack_positions(x_positions, rows, n_players),
+                               self._stack_positions(y_positions, rows, n_players)], axis=-1)
+            perimeter[rows], area[rows] = convex_hull_perimeter_and_area(points)
+
+        return perimeter, area
+
+    @instrumentation.timed("clustering")
+    def _cluster_positions(self, positions):
+        centroids = np.full((len(positions), 3), np.nan)
+        counts = np.zeros((len(positions), 3), dtype=np.int64)
+
+        for rows, n_players in self._group_rows_by_team_size(positions):
+            if n_players < 3:
+                continue
+            values = self._stack_positions(positions, rows, n_players)
+
+            if self.exact_clustering:
+                centroids[rows], counts[rows] = cluster_1d_into_3_smallest_to_largest(values)
+            else:
+                for row, row_values in zip(rows, values):
+                    clusters = self._cluster_into_3_smallest_to_largest(row_values.reshape(-1, 1))
+                    centroids[row] = clusters["cluster_centroids"]
+                    counts[row] = [clusters[f"cluster_{i}_count"] for i in range(3)]
+
+        return centroids, counts
+
+    def _compute_formation_shape_table(self, aggregated):
+        hull_perimeter, hull_volume = self._compute_hulls(aggregated["x_positions"], aggregated["y_positions"])
+
+        x_centroids, x_counts = self._cluster_positions(aggregated["x_rel_los_positions"])
+        y_centroids, y_counts = self._cluster_positions(aggregated["y_positions"])
+
+        return pl.DataFrame({
+            "hull_perimeter": hull_perimeter,
+            "hull_volume": hull_volume,
+            **{f"x_cluster_{i}_centroid": x_centroids[:, i] for i in range(3)},
+            **{f"y_cluster_{i}_centroid": y_centroids[:, i] for i in range(3)},
+            **{f"x_cluster_{i}_count": x_counts[:, i] for i in range(3)},
+            **{f"y_cluster_{i}_count": y_counts[:, i] for i in range(3)},
+        }, schema=FORMATION_SCHEMA)
+
+    @instrumentation.timed("formation_aggregation")
+    def _aggregate_formation_features(self, tracking, los):
+        formation_tracking = self._add_formation_indicators(tracking, los)
+
+        aggregated = formation_tracking.\
+            group_by(["gameId", "playId", "team"], maintain_order=True).\
+            agg(x_centroid=pl.col("x").mean(),
+                x_rel_centroid=pl.col("x_rel_los").mean(),
+                y_centroid=pl.col("y").mean(),
+                depth=pl.col("x").max() - pl.col("x").min(),
+                width=pl.col("y").max() - pl.col("y").min(),
+                in_tackle_box=pl.col("in_tackle_box").sum(),
+                left_side=pl.col("left_side").sum(),
+                right_side=pl.col("right_side").sum(),
+                in_motion=pl.col("in_motion").sum(),
+                average_speed=pl.col("s").mean(),
+                x_positions=pl.col("x"),
+                y_positions=pl.col("y"),
+                x_rel_los_positions=pl.col("x_rel_los"))
+
+        # Hull and cluster features need the full set of positions for each team
+        formation_shape = self._compute_formation_shape_table(aggregated)
+
+        return aggregated.\
+            drop(["x_positions", "y_positions", "x_rel_los_positions"]).\
+            hstack(formation_shape)
+
+    def _name_team_formation_features(self, aggregated, team):
+        feature_names = OFFENSE_SPATIAL_FEATURE_NAMES if team == "offense" else DEFENSE_SPATIAL_FEATURE_NAMES
+        return aggregated.\
+            filter(pl.col("team") == team).\
+            select("gameId", "playId", *[pl.col(feature).alias(name) for feature, name in feature_names.items()])
+
+    def _compute_spatial_feature_table(self, key_frame_tracking, los):
+        aggregated = self._aggregate_formation_features(key_frame_tracking, los)
+        offense = self._name_team_formation_features(aggregated, "offense")
+        defense = self._name_team_formation_features(aggregated, "defense")
+        return offense.join(defense, on=PLAY_KEYS, how="inner")
+
+    def _create_los_df(self, play_data):
+        return pl.DataFrame({
+            "gameId": [play_data["play_info"]["gameId"]],
+            "playId": [play_data["play_info"]["playId"]],
+            "x_los": [play_data["x_los"]],
+            "y_los": [play_data["y_los"]],
+        }, schema_overrides={"x_los": pl.Float64, "y_los": pl.Float64})
 
-        return {
-            "offense_x_centroid": x_centroid,
-            "offense_x_rel_centroid": x_rel_centroid,
-            "offense_y_centroid": y_centroid,
-            "offense_depth": offense_depth,
-            "offense_width": offense_width,
-            "offense_in_box": offense_in_box,
-            "offense_left_side": left_sided_offense,
-            "offense_right_side": right_sided_offense,
-            "offense_in_motion": players_in_motion,
-            "offense_average_speed": average_speed,
-            "offense_hull_perimeter": hull_perimeter,
-            "offense_hull_volume": hull_volume,
-            "offense_depth_back_cluster_centroid": x_clusters["cluster_0_centroid"],
-            "offense_depth_middle_cluster_centroid": x_clusters["cluster_1_centroid"],
-            "offense_depth_front_cluster_centroid": x_clusters["cluster_2_centroid"],
-            "offense_width_left_cluster_centroid": y_clusters["cluster_0_centroid"],
-            "offense_width_middle_cluster_centroid": y_clusters["cluster_1_centroid"],
-            "offense_width_right_cluster_centroid": y_clusters["cluster_2_centroid"],
-            "offense_depth_back_cluster_count": x_clusters["cluster_0_count"],
-            "offense_depth_middle_cluster_count": x_clusters["cluster_1_count"],
-            "offense_depth_front_cluster_count": x_clusters["cluster_2_count"],
-            "offense_width_left_cluster_count": y_clusters["cluster_0_count"],
-            "offense_width_middle_cluster_count": y_clusters["cluster_1_count"],
-            "offense_width_right_cluster_count": y_clusters["cluster_2_count"]
-        }
+    def compute_offense_spatial_features(self, play_data, offense_tracking):
+        aggregated = self._aggregate_formation_features(offense_tracking, self._create_los_df(play_data))
+        return self._table_row_to_dict(self._name_team_formation_features(aggregated, "offense"), drop_keys=True)
 
     def compute_defense_spatial_features(self, play_data, defense_tracking):
+        aggregated = self._aggregate_formation_features(defense_tracking, self._create_los_df(play_data))
+        return self._table_row_to_dict(self._name_team_formation_features(aggregated, "defense"), drop_keys=True)
 
-        defense_tracking = defense_tracking.\
-            with_columns(x_rel_los = pl.col("x") - play_data["x_los"],
-                        in_tackle_box = pl.when((pl.col("x") <= (play_data["x_los"] + 5)) & 
-                                                (pl.col("y") <= (play_data["y_los"] + 4)) & 
-                                                (pl.col("y") >= (play_data["y_los"] - 4))).then(1).otherwise(0),
-                        left_side = pl.when(pl.col("y") <= play_data["y_los"]).then(1).otherwise(0),
-                        right_side = pl.when(pl.col("y") >= play_data["y_los"]).then(1).otherwise(0),
-                        in_motion = pl.when(pl.col("s") > 0.6).then(1).otherwise(0))
-
-        x_centroid = defense_tracking["x"].mean()
-        x_rel_centroid = defense_tracking["x_rel_los"].mean()
-        y_centroid = defense_tracking["y"].mean()
-
-        defense_depth = defense_tracking["x"].max() - defense_tracking["x"].min()
-        defense_width = defense_tracking["y"].max() - defense_tracking["y"].min()
-
-        left_sided_defenders = defense_tracking["left_side"].sum()
-        right_sided_defenders = defense_tracking["right_side"].sum()
-        defenders_in_box = defense_tracking["in_tackle_box"].sum()
-
-        players_in_motion = defense_tracking["in_motion"].sum()
-        average_speed = defense_tracking["s"].mean()
-
-        hull = ConvexHull(defense_tracking[["x", "y"]].to_numpy())
-        hull_perimeter = hull.area
-        hull_volume = hull.volume
-
-        x_clusters = self._cluster_into_3_smallest_to_largest(defense_tracking[["x_rel_los"]].to_numpy())
-        y_clusters = self._cluster_into_3_smallest_to_largest(defense_tracking[["y"]].to_numpy())
-
-        return {
-            "defense_x_centroid": x_centroid,
-            "defense_x_rel_centroid": x_rel_centroid,
-            "defense_y_centroid": y_centroid,
-            "defense_depth": defense_depth,
-            "defense_width": defense_width,
-            "defenders_in_box": defenders_in_box,
-            "defenders_left_side": left_sided_defenders,
-            "defenders_right_side": right_sided_defenders,
-            "defenders_in_motion": players_in_motion,
-            "defense_average_speed": average_speed,
-            "defense_hull_perimeter": hull_perimeter,
-            "defense_hull_volume": hull_volume,
-            "defense_depth_front_cluster_centroid": x_clusters["cluster_0_centroid"],
-            "defense_depth_middle_cluster_centroid": x_clusters["cluster_1_centroid"],
-            "defense_depth_back_cluster_centroid": x_clusters["cluster_2_centroid"],
-            "defense_width_left_cluster_centroid": y_clusters["cluster_0_centroid"],
-            "defense_width_middle_cluster_centroid": y_clusters["cluster_1_centroid"],
-            "defense_width_right_cluster_centroid": y_clusters["cluster_2_centroid"],
-            "defense_depth_back_cluster_count": x_clusters["cluster_0_count"],
-            "defense_depth_middle_cluster_count": x_clusters["cluster_1_count"],
-            "defense_depth_front_cluster_count": x_clusters["cluster_2_count"],
-            "defense_width_left_cluster_count": y_clusters["cluster_0_count"],
-            "defense_width_middle_cluster_count": y_clusters["cluster_1_count"],
-            "defense_width_right_cluster_count": y_clusters["cluster_2_count"]
-        }
-
-    def _calculate_pre_snap_look_changes(self, line_set_tracking, ball_snap_tracking):
+    def _compute_pre_snap_look_change_table(self, line_set_tracking, ball_snap_tracking):
         pre_snap_location_change = line_set_tracking.\
-            join(ball_snap_tracking.select(pl.col("nflId"), x_snap=pl.col("x"), y_snap=pl.col("y")), 
-                on=["nflId"]).\
+            join(ball_snap_tracking.select(pl.col("gameId"), pl.col("playId"), pl.col("nflId"), x_snap=pl.col("x"), y_snap=pl.col("y")), 
+                on=["gameId", "playId", "nflId"]).\
             with_columns(x_diff=np.abs(pl.col("x") - pl.col("x_snap")), 
                         y_diff=np.abs(pl.col("y") - pl.col("y_snap")),
                         diff=((pl.col("x") - pl.col("x_snap"))**2 + (pl.col("y") - pl.col("y_snap"))**2)**0.5)
 
         aggregated_change = pre_snap_location_change.\
-            group_by(pl.col("team")).\
+            group_by(["gameId", "playId", "team"], maintain_order=True).\
             agg(total_pairwise_x_change=pl.col("x_diff").sum(), 
                 total_pairwise_y_change=pl.col("y_diff").sum(), 
-                total_location_change=pl.col("diff").sum()).\
-            to_dicts()
-        
-        output = {
-            f"{row['team']}_{col}": row[col]
-            for row in aggregated_change
-            for col in ['total_pairwise_x_change', 'total_pairwise_y_change', 'total_location_change']
+                total_location_change=pl.col("diff").sum())
+
+        plays = aggregated_change.select(PLAY_KEYS).unique(maintain_order=True)
+        for team in ["offense", "defense"]:
+            team_change = aggregated_change.\
+                filter(pl.col("team") == team).\
+                select("gameId", "playId", *[pl.col(col).alias(f"{team}_{col}") for col in ['total_pairwise_x_change', 'total_pairwise_y_change', 'total_location_change']])
+            plays = plays.join(team_change, on=PLAY_KEYS, how="left")
+
+        return plays
+
+    def _calculate_pre_snap_look_changes(self, line_set_tracking, ball_snap_tracking):
+        return self._table_row_to_dict(self._compute_pre_snap_look_change_table(line_set_tracking, ball_snap_tracking), drop_keys=True)
+
+    def _compute_feature_tables(self, plays_df, key_frame_tracking, frames):
+        # The line of scrimmage is always taken from the line_set frame
+        with instrumentation.span("key_frames"):
+            key_frames = {frame: self._get_first_event_frame(key_frame_tracking[frame]) for frame in {"line_set", *frames}}
+            los = self._get_line_of_scrimmage(key_frames["line_set"])
+
+        spatial_features = {}
+        for frame in frames:
+            with instrumentation.span(f"spatial_features/{frame}"):
+                spatial_features[frame] = instrumentation.record_frame(self._compute_spatial_feature_table(key_frames[frame], los))
+
+        # Only keep plays that have features for every requested frame
+        plays = plays_df.join(los, on=PLAY_KEYS, how="semi")
+        for frame in frames:
+            plays = plays.join(spatial_features[frame], on=PLAY_KEYS, how="semi")
+
+        with instrumentation.span("game_state"):
+            game_state_features = self._compute_game_state_table(plays)
+            targets = self._compute_target_table(plays).drop(PLAY_KEYS)
+
+        tables = {
+            "game_state_features": game_state_features,
+            "game_state_features_with_target": pl.concat([game_state_features, targets], how="horizontal"),
         }
 
-        return output
-        
+        for frame in frames:
+            frame_spatial_features = plays.select(PLAY_KEYS).join(spatial_features[frame], on=PLAY_KEYS, how="left")
+            tables[f"{frame}_spatial_features"] = frame_spatial_features
+            tables[f"{frame}_spatial_features_with_target"] = pl.concat([frame_spatial_features, targets], how="horizontal")
+            tables[f"{frame}_game_state_with_spatial_features_and_target"] = pl.concat([game_state_features, frame_spatial_features.drop(PLAY_KEYS), targets], how="horizontal")
+
+        if "line_set" in frames and "ball_snap" in frames:
+            with instrumentation.span("pre_snap_change"):
+                pre_snap_location_change = plays.select(PLAY_KEYS).\
+                    join(self._compute_pre_snap_look_change_table(key_frames["line_set"], key_frames["ball_snap"]), on=PLAY_KEYS, how="left")
+            tables["pre_snap_location_change"] = pre_snap_location_change
+            tables["spatial_change_epa_state"] = pl.concat([
+                game_state_features,
+                plays.select("possessionTeam", "defensiveTeam", "playHadPlayersInMotionAtSnap", "playHadMotionAndCameSet", "expectedPointsAdded", "playType"),
+                pre_snap_location_change.select(offenseChange=pl.col("offense_total_location_change"), defenseChange=pl.col("defense_total_location_change")),
+            ], how="horizontal")
+
+        return tables
+
+    def build_feature_tables(self, frames=["line_set", "ball_snap"], cache_dir=None):
+        """
+        Compute the model features for every play at once. Returns a dict of DataFrames keyed
+        like the output of get_model_features, including the five model tables:
+        game_state_features_with_target, {frame}_spatial_features_with_target and
+        {frame}_game_state_with_spatial_features_and_target for each frame.
+
+        If cache_dir is given, the tables are persisted there and later runs only recompute
+        plays that are new, whose inputs changed, or whose feature code changed.
+
+        """
+        if cache_dir is not None:
+            return FeatureCache(cache_dir, frames).get_feature_tables(self)
+
+        key_frame_tracking = self._get_key_frame_tracking(frames)
+        with instrumentation.span("build_feature_tables"):
+            return self._compute_feature_tables(self.data.plays_df, key_frame_tracking, frames)
+
+    def _get_key_frame_tracking(self, frames):
+        # The tracking of each requested frame, and of line_set for the line of scrimmage
+        missing_frames = [frame for frame in frames if frame not in self.data.key_events]
+        if missing_frames:
+            raise ValueError(f"Frames {missing_frames} are not key events of the data, add them to the key_events of BigDataBowlData")
+        return {frame: self.data.key_event_tracking[frame] for frame in dict.fromkeys(["line_set", *frames])}
+
+    def build_pre_snap_motion_features(self):
+        """
+        Path length, max speed, time in motion, net displacement and zone transitions of the offense and
+        defense over every frame from line_set to ball_snap, for every play, in one pass over the tracking data.
+
+        """
+        tracking = self.data.tracking_data_processor.add_offense_indicator(self.data.tracking_data, self.data.plays_df.lazy())
+        return instrumentation.collect("pre_snap_motion_features", compute_pre_snap_motion_features(tracking, self.data.plays_df))
+
+    def _compute_feature_tables_with_errors(self, plays_df, key_frame_tracking, frames):
+        try:
+            tables = self._compute_feature_tables(plays_df, key_frame_tracking, frames)
+            errors = []
+        except Exception:
+            # Fall back to one play at a time to find the plays that fail
+            empty_frames = {frame: tracking.clear() for frame, tracking in key_frame_tracking.items()}
+            play_tables = [self._compute_feature_tables(plays_df.clear(), empty_frames, frames)]
+            errors = []
+            for game_id, play_id in plays_df.select(PLAY_KEYS).iter_rows():
+                is_play = (pl.col("gameId") == game_id) & (pl.col("playId") == play_id)
+                try:
+                    play_tables.append(self._compute_feature_tables(
+                        plays_df.filter(is_play),
+                        {frame: tracking.filter(is_play) for frame, tracking in key_frame_tracking.items()},
+                        frames))
+                except Exception as e:
+                    errors.append({"gameId": game_id, "playId": play_id, "exception_type": type(e).__name__, "message": str(e)})
+            tables = {name: pl.concat([table[name] for table in play_tables], how="vertical_relaxed") for name in play_tables[0]}
+
+        # Plays without tracking for every key frame are dropped by the feature tables
+        missing_plays = plays_df.select(PLAY_KEYS).\
+            join(tables["game_state_features"], on=PLAY_KEYS, how="anti").\
+            join(pl.DataFrame(errors, schema=ERROR_SCHEMA), on=PLAY_KEYS, how="anti")
+        for game_id, play_id in missing_plays.iter_rows():
+            errors.append({"gameId": game_id, "playId": play_id, "exception_type": "MissingKeyFrame", "message": f"No tracking data for every frame in {frames}"})
+
+        return tables, pl.DataFrame(errors, schema=ERROR_SCHEMA)
+
+    def extract_all(self, n_workers=None, frames=["line_set", "ball_snap"], games_per_task=4):
+        """
+        Compute the feature tables for every play across a process pool, sharding the plays by game.
+        The plays and key frame tracking are written once to Arrow IPC files, which each worker
+        memory maps rather than receiving a pickled copy per task.
+
+        Returns the feature tables, keyed like build_feature_tables, and an error table with the
+        gameId, playId, exception_type and message of every play that has no features.
+
+        """
+        n_workers = n_workers or os.cpu_count()
+        plays_df = self.data.plays_df
+        key_frame_tracking = self._get_key_frame_tracking(frames)
+        game_ids = plays_df["gameId"].unique(maintain_order=True).to_list()
+        game_shards = [game_ids[i:i + games_per_task] for i in range(0, len(game_ids), games_per_task)]
+
+        if not game_shards:
+            # Empty tables, with the same columns as when there are plays
+            return self._compute_feature_tables_with_errors(plays_df, key_frame_tracking, frames)
+
+        if n_workers == 1:
+            # In this process the frames are used as they are, without the IPC files or worker state
+            results = [self._compute_feature_tables_with_errors(*_select_game_shard(plays_df, key_frame_tracking, shard), frames)
+                       for shard in game_shards]
+        else:
+            shared_frames = {"plays_df": plays_df, **{f"{frame}_tracking": tracking for frame, tracking in key_frame_tracking.items()}}
+            with shared_frame_pool(shared_frames, n_workers, _init_feature_worker, (self.exact_clustering,)) as executor:
+                results = list(executor.map(_extract_game_shard, game_shards, [frames] * len(game_shards)))
 
+        tables = {name: pl.concat([result[0][name] for result in results], how="vertical_relaxed") for name in results[0][0]}
+        errors = pl.concat([result[1] for result in results])
+        return tables, errors
 
+    @instrumentation.timed("get_model_features")
     def get_model_features(self, gameId, playId):
 
-        play_data = self.get_specific_play_data(gameId, playId)
-        game_state_features = self.get_game_state_features(play_data["play_info"])
+        with instrumentation.span("lookup"):
+            play_data = self.data.get_play_data(gameId, playId)
+
+        return self._get_model_features_from_play_data(play_data)
+
+    def iter_model_features(self, batch_size=64, prefetch=2):
+        """
+        Yield the features of every play, as returned by get_model_features, in storage order,
+        with the plays read ahead in batches by BigDataBowlData.iter_plays.
+
+        """
+        for batch in self.data.iter_plays(batch_size=batch_size, prefetch=prefetch):
+            for play_data in batch:
+                with instrumentation.span("get_model_features"):
+                    features = self._get_model_features_from_play_data(play_data)
+                yield features
+
+    def _get_model_features_from_play_data(self, play_data):
+        gameId, playId = play_data["play_df"].select("gameId", "playId").row(0)
 
         if len(play_data["line_set_tracking"]) == 0:
             print(f"Play {gameId}-{playId} has no line set tracking data")
@@ -250,79 +527,37 @@ class PlayPredictionModel:
             print(f"Play {gameId}-{playId} has no ball snap tracking data")
             return None
 
-        pre_snap_look_change = self._calculate_pre_snap_look_changes(play_data["line_set_tracking"], play_data["ball_snap_tracking"])
+        key_frame_tracking = {frame: play_data[f"{frame}_tracking"] for frame in ["line_set", "ball_snap"]}
+        with instrumentation.span("feature_tables"):
+            tables = self._compute_feature_tables(play_data["play_df"], key_frame_tracking, ["line_set", "ball_snap"])
 
-        offense_line_set_spatial_features = self.compute_offense_spatial_features(play_data, play_data["line_set_tracking"].filter(pl.col("team") == "offense"))
-        defense_line_set_spatial_features = self.compute_defense_spatial_features(play_data, play_data["line_set_tracking"].filter(pl.col("team") == "defense"))
+        with instrumentation.span("dict_building"):
+            return {"play_info": self._create_play_info_dict(play_data["play_df"]),
+                    "game_state_features": self._table_row_to_dict(tables["game_state_features"]),
+                    "pre_snap_location_change": self._table_row_to_dict(tables["pre_snap_location_change"], drop_keys=True),
+                    "line_set_spatial_features": self._table_row_to_dict(tables["line_set_spatial_features"], drop_keys=True),
+                    "ball_snap_spatial_features": self._table_row_to_dict(tables["ball_snap_spatial_features"], drop_keys=True),
+                    "spatial_change_epa_state": self._table_row_to_dict(tables["spatial_change_epa_state"]),
+                    "game_state_features_with_target": self._table_row_to_dict(tables["game_state_features_with_target"]),
+                    "line_set_spatial_features_with_target": self._table_row_to_dict(tables["line_set_spatial_features_with_target"]),
+                    "ball_snap_spatial_features_with_target": self._table_row_to_dict(tables["ball_snap_spatial_features_with_target"]),
+                    "line_set_game_state_with_spatial_features_and_target": self._table_row_to_dict(tables["line_set_game_state_with_spatial_features_and_target"]),
+                    "ball_snap_game_state_with_spatial_features_and_target": self._table_row_to_dict(tables["ball_snap_game_state_with_spatial_features_and_target"])
+                    }
 
-        offense_ball_snap_spatial_features = self.compute_offense_spatial_features(play_data, play_data["ball_snap_tracking"].filter(pl.col("team") == "offense"))
-        defense_ball_snap_spatial_features = self.compute_defense_spatial_features(play_data, play_data["ball_snap_tracking"].filter(pl.col("team") == "defense"))
 
-        line_set_spatial_features = {**offense_line_set_spatial_features, **defense_line_set_spatial_features}
-        ball_snap_spatial_features = {**offense_ball_snap_spatial_features, **defense_ball_snap_spatial_features}
+def _init_feature_worker(paths, exact_clustering):
+    shared_frames = read_shared_frames(paths)
+    _feature_worker_state["model"] = PlayPredictionModel(None, exact_clustering=exact_clustering)
+    _feature_worker_state["plays_df"] = shared_frames.pop("plays_df")
+    _feature_worker_state["key_frame_tracking"] = {name.removesuffix("_tracking"): frame for name, frame in shared_frames.items()}
 
-        spatial_change_epa_state = {
-            **game_state_features,
-            "possessionTeam": play_data["play_info"]["possessionTeam"],
-            "defensiveTeam": play_data["play_info"]["defensiveTeam"],
-            "playHadPlayersInMotionAtSnap": play_data["play_info"]["playHadPlayersInMotionAtSnap"],
-            "playHadMotionAndCameSet": play_data["play_info"]["playHadMotionAndCameSet"],
-            "expectedPointsAdded": play_data["play_info"]["expectedPointsAdded"],
-            "playType": play_data["play_info"]["playType"],
-            "offenseChange": pre_snap_look_change["offense_total_location_change"],
-            "defenseChange": pre_snap_look_change["defense_total_location_change"],
-        }
 
-        game_state_features_with_target = {
-            **game_state_features,
-            "playType": play_data["play_info"]["playType"],
-            "isPass": 1 if play_data["play_info"]["playType"] == "pass" else 0,
-            "split": "train" if play_data["play_info"]["week"] <= 6 else "test"
-        }
+def _select_game_shard(plays_df, key_frame_tracking, game_ids):
+    in_shard = pl.col("gameId").is_in(game_ids)
+    return plays_df.filter(in_shard), {frame: tracking.filter(in_shard) for frame, tracking in key_frame_tracking.items()}
 
-        line_set_spatial_features_with_target = {
-            "gameId": play_data["play_info"]["gameId"],
-            "playId": play_data["play_info"]["playId"],
-            **line_set_spatial_features,
-            "playType": play_data["play_info"]["playType"],
-            "isPass": 1 if play_data["play_info"]["playType"] == "pass" else 0,
-            "split": "train" if play_data["play_info"]["week"] <= 6 else "test"
-        }
 
-        ball_snap_spatial_features_with_target = {
-            "gameId": play_data["play_info"]["gameId"],
-            "playId": play_data["play_info"]["playId"],
-            **ball_snap_spatial_features,
-            "playType": play_data["play_info"]["playType"],
-            "isPass": 1 if play_data["play_info"]["playType"] == "pass" else 0,
-            "split": "train" if play_data["play_info"]["week"] <= 6 else "test"
-        }
-
-        line_set_game_state_with_spatial_features_and_target = {
-            **game_state_features,
-            **line_set_spatial_features,
-            "playType": play_data["play_info"]["playType"],
-            "isPass": 1 if play_data["play_info"]["playType"] == "pass" else 0,
-            "split": "train" if play_data["play_info"]["week"] <= 6 else "test"
-        }
-
-        ball_snap_game_state_with_spatial_features_and_target = {
-            **game_state_features,
-            **ball_snap_spatial_features,
-            "playType": play_data["play_info"]["playType"],
-            "isPass": 1 if play_data["play_info"]["playType"] == "pass" else 0,
-            "split": "train" if play_data["play_info"]["week"] <= 6 else "test"
-        }
- 
-        return {"play_info": play_data["play_info"],
-                "game_state_features": game_state_features,
-                "pre_snap_location_change": pre_snap_look_change,
-                "line_set_spatial_features": line_set_spatial_features,
-                "ball_snap_spatial_features": ball_snap_spatial_features,
-                "spatial_change_epa_state": spatial_change_epa_state,
-                "game_state_features_with_target": game_state_features_with_target,
-                "line_set_spatial_features_with_target": line_set_spatial_features_with_target,
-                "ball_snap_spatial_features_with_target": ball_snap_spatial_features_with_target,
-                "line_set_game_state_with_spatial_features_and_target": line_set_game_state_with_spatial_features_and_target,
-                "ball_snap_game_state_with_spatial_features_and_target": ball_snap_game_state_with_spatial_features_and_target
-                }
\ No newline at end of file
+def _extract_game_shard(game_ids, frames):
+    plays_df, key_frame_tracking = _select_game_shard(_feature_worker_state["plays_df"], _feature_worker_state["key_frame_tracking"], game_ids)
+    return _feature_worker_state["model"]._compute_feature_tables_with_errors(plays_df, key_frame_tracking, frames)
@@ -0,0 +1,131 @@
+# Dense array representation of a play's tracking data
+import numpy as np
+import polars as pl
+from .play_index import PLAY_KEYS
+
+
+TENSOR_FEATURES = ["x", "y", "s", "a", "dir", "o"]
+
+
+class PlayTensor:
+    def __init__(self,
+                 game_id: int,
+                 play_id: int,
+                 frame_ids: np.ndarray,
+                 nfl_ids: np.ndarray,
+                 clubs: np.ndarray,
+                 teams: np.ndarray | None,
+                 events: dict,
+                 values: np.ndarray) -> None:
+        """
+        Tracking data for one play as a float32 array of shape (n_frames, n_entities, n_features),
+        where the entities are the players ordered by nflId followed by the football (nflId -1).
+        Entities missing from a frame are NaN. Build these in bulk with PlayTensor.from_tracking.
+
+        """
+        self.game_id = game_id
+        self.play_id = play_id
+        self.frame_ids = frame_ids
+        self.nfl_ids = nfl_ids
+        self.clubs = clubs
+        self.teams = teams
+        self.events = events
+        self.values = values
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def get_frame_index(self, frame_id: int) -> int:
+        frame_index = int(np.searchsorted(self.frame_ids, frame_id))
+        if frame_index == len(self.frame_ids) or self.frame_ids[frame_index] != frame_id:
+            raise KeyError(f"No frame {frame_id} in play {self.game_id}, {self.play_id}")
+        return frame_index
+
+    def get_frame(self, frame_id: int) -> np.ndarray:
+        return self.values[self.get_frame_index(frame_id)]
+
+    def get_event_frame(self, event: str) -> np.ndarray | None:
+        if event not in self.events:
+            return None
+        return self.get_frame(self.events[event])
+
+    def get_feature(self, feature: str) -> np.ndarray:
+        return self.values[..., TENSOR_FEATURES.index(feature)]
+
+    def get_entity_mask(self, team: str) -> np.ndarray:
+        # Matches either the offense/defense/football label or the club
+        mask = self.clubs == team
+        if self.teams is not None:
+            mask |= self.teams == team
+        return mask
+
+    @classmethod
+    def from_tracking(cls, tracking_df: pl.DataFrame) -> dict:
+        """
+        Build the tensors for every play in tracking_df at once: one sort, then a scatter of all the
+        rows into a single contiguous buffer that each play's tensor is a view of.
+
+        """
+        has_teams = "team" in tracking_df.columns
+        tracking_df = tracking_df.\
+            with_columns(nflId=pl.col("nflId").cast(pl.Int64).fill_null(-1)).\
+            sort([*PLAY_KEYS, "frameId", "nflId"]).\
+            with_columns(
+                frame_index=(pl.col("frameId").rank("dense") - 1).over(PLAY_KEYS),
+                # Rank the football (-1) after the players
+                entity_index=(pl.col("nflId").replace(-1, np.iinfo(np.int64).max).rank("dense") - 1).over(PLAY_KEYS),
+            )
+
+        plays = tracking_df.\
+            group_by(PLAY_KEYS, maintain_order=True).\
+            agg(n_frames=pl.col("frame_index").max() + 1,
+                n_entities=pl.col("entity_index").max() + 1).\
+            with_columns(size=pl.col("n_frames") * pl.col("n_entities")).\
+            with_columns(grid_offset=pl.col("size").cum_sum() - pl.col("size"),
+                         frame_offset=pl.col("n_frames").cum_sum() - pl.col("n_frames"),
+                         entity_offset=pl.col("n_entities").cum_sum() - pl.col("n_entities"))
+
+        flat_index = tracking_df.\
+            join(plays, on=PLAY_KEYS, how="left").\
+            select(pl.col("grid_offset") + pl.col("frame_index") * pl.col("n_entities") + pl.col("entity_index")).\
+            to_series().to_numpy()
+        buffer = np.full((plays["size"].sum(), len(TENSOR_FEATURES)), np.nan, dtype=np.float32)
+        buffer[flat_index] = tracking_df.select(TENSOR_FEATURES).to_numpy().astype(np.float32)
+
+        # Per frame and per entity lookups, in the same play order as the buffer
+        frame_ids = tracking_df.\
+            group_by([*PLAY_KEYS, "frame_index"], maintain_order=True).\
+            agg(pl.col("frameId").first())["frameId"].to_numpy()
+        entities = tracking_df.\
+            group_by([*PLAY_KEYS, "entity_index"]).\
+            agg(pl.col("nflId").first(), pl.col("club", *(["team"] if has_teams else [])).first().cast(pl.String)).\
+            sort([*PLAY_KEYS, "entity_index"])
+        nfl_ids = entities["nflId"].to_numpy()
+        clubs = entities["club"].to_numpy()
+        teams = entities["team"].to_numpy() if has_teams else None
+
+        events = {}
+        for game_id, play_id, event, frame_id in tracking_df.\
+                filter(pl.col("event").is_not_null()).\
+                group_by([*PLAY_KEYS, "event"]).\
+                agg(pl.col("frameId").min()).\
+                sort([*PLAY_KEYS, "frameId"]).\
+                select([*PLAY_KEYS, pl.col("event").cast(pl.String), "frameId"]).\
+                iter_rows():
+            events.setdefault((game_id, play_id), {})[event] = frame_id
+
+        play_tensors = {}
+        for game_id, play_id, n_frames, n_entities, size, grid_offset, frame_offset, entity_offset in plays.iter_rows():
+            play_entities = slice(entity_offset, entity_offset + n_entities)
+            play_tensors[(game_id, play_id)] = cls(
+                game_id=game_id,
+                play_id=play_id,
+                frame_ids=frame_ids[frame_offset:frame_offset + n_frames],
+                nfl_ids=nfl_ids[play_entities],
+                clubs=clubs[play_entities],
+                teams=teams[play_entities] if has_teams else None,
+                events=events.get((game_id, play_id), {}),
+                values=buffer[grid_offset:grid_offset + size].reshape(n_frames, n_entities, len(TENSOR_FEATURES)),
+            )
+        return play_tensors
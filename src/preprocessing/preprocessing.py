@@ -1,6 +1,31 @@
+import queue
+import threading
 import polars as pl
-from .tracking_data import TrackingDataProcessor
+from functools import cached_property
+from .tracking_data import TrackingDataProcessor, COMPACT_TRACKING_DTYPES, get_week
 from .non_tracking_data import NonTrackingDataProcessor
+from .play_index import PlayIndex, PLAY_KEYS
+from .play_tensor import PlayTensor
+from .tracking_cube import TrackingCube
+from . import instrumentation
+
+
+# Key events the play features rely on, always extracted alongside any requested events
+REQUIRED_KEY_EVENTS = ["line_set", "ball_snap"]
+
+# Put on the prefetch queue by iter_plays' reader thread once every batch has been read
+_END_OF_PLAYS = object()
+
+
+def _put_unless_stopped(batch_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    # Wait for space on the queue, giving up if the consumer has stopped iterating
+    while not stop.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 class BigDataBowlData:
     def __init__(self, 
@@ -8,51 +33,292 @@ class BigDataBowlData:
                  plays_file_path: str,
                  player_file_path: str,
                  player_plays_file_path: str,
-                 tracking_data_file_paths: list[str]) -> None:
-        
-        self.tracking_data_processor = TrackingDataProcessor(tracking_data_file_paths)
-        self.non_tracking_data_processor = NonTrackingDataProcessor(games_file_path,
-                                                                    plays_file_path,
-                                                                    player_file_path,
-                                                                    player_plays_file_path)
-        
-        self.raw_games = self.non_tracking_data_processor.games
-        self.raw_plays = self.non_tracking_data_processor.plays.collect()
-        self.raw_players = self.non_tracking_data_processor.players.collect()
-        self.raw_player_plays = self.non_tracking_data_processor.player_plays.collect()
-        
-        self.plays_df = self.non_tracking_data_processor.feature_engineer_play_data().collect()
-
-        self.tracking_data = self.tracking_data_processor.process()
-
-        line_set_tracking = self.tracking_data.filter(pl.col("event") == "line_set").collect()
-        ball_snap_tracking = self.tracking_data.filter(pl.col("event") == "ball_snap").collect()
-
-        self.line_set_tracking = self._add_offense_indicator_to_tracking_data(line_set_tracking)
-        self.ball_snap_tracking = self._add_offense_indicator_to_tracking_data(ball_snap_tracking)
-        
+                 tracking_data_file_paths: list[str],
+                 tracking_store_path: str = None,
+                 key_events: list[str] = REQUIRED_KEY_EVENTS,
+                 tracking_dtypes: dict = COMPACT_TRACKING_DTYPES) -> None:
+        """
+        Lazily loaded play, player and tracking data. If any of tracking_dtypes is Categorical, this
+        turns on Polars' global string cache for the rest of the process, as tracking collected at
+        different times (e.g. each batch of iter_plays, or each week added by ingest_tracking_weeks)
+        is combined, and local categoricals would be re-encoded, with a warning, on every combine.
+
+        """
+        if any(dtype == pl.Categorical for dtype in tracking_dtypes.values()):
+            pl.enable_string_cache()
+
+        self.tracking_data_processor = TrackingDataProcessor(tracking_data_file_paths, tracking_store_path, tracking_dtypes)
+        self.non_tracking_file_paths = (games_file_path, plays_file_path, player_file_path, player_plays_file_path)
+        self.key_events = list(dict.fromkeys([*REQUIRED_KEY_EVENTS, *key_events]))
+
+        # Built one at a time on first use, see _get_play_index
+        self.play_indexes = {}
+
+    # Everything below is loaded on first access and then memoised, so a session only pays for the data it uses
+    @cached_property
+    def non_tracking_data_processor(self) -> NonTrackingDataProcessor:
+        # Scanning the csvs infers their schemas, which reads each file
+        with instrumentation.span("scan_non_tracking_csvs"):
+            return NonTrackingDataProcessor(*self.non_tracking_file_paths)
+
+    @cached_property
+    def raw_games(self) -> pl.LazyFrame:
+        return self.non_tracking_data_processor.games
+
+    @cached_property
+    def raw_plays(self) -> pl.DataFrame:
+        return instrumentation.collect("raw_plays", self.non_tracking_data_processor.plays)
+
+    @cached_property
+    def raw_players(self) -> pl.DataFrame:
+        return instrumentation.collect("raw_players", self.non_tracking_data_processor.players)
+
+    @cached_property
+    def raw_player_plays(self) -> pl.DataFrame:
+        return instrumentation.collect("raw_player_plays", self.non_tracking_data_processor.player_plays)
+
+    @cached_property
+    def plays_df(self) -> pl.DataFrame:
+        return instrumentation.collect("feature_engineer_play_data", self.non_tracking_data_processor.feature_engineer_play_data())
+
+    @cached_property
+    def tracking_data(self) -> pl.LazyFrame:
+        with instrumentation.span("load_tracking_data"):
+            return self.tracking_data_processor.process()
+
+    @cached_property
+    def key_event_tracking(self) -> dict:
+        return self.extract_key_event_tracking(self.key_events)
+
+    @property
+    def line_set_tracking(self) -> pl.DataFrame:
+        return self.key_event_tracking["line_set"]
+
+    @line_set_tracking.setter
+    def line_set_tracking(self, tracking: pl.DataFrame) -> None:
+        self.key_event_tracking["line_set"] = tracking
+
+    @property
+    def ball_snap_tracking(self) -> pl.DataFrame:
+        return self.key_event_tracking["ball_snap"]
+
+    @ball_snap_tracking.setter
+    def ball_snap_tracking(self, tracking: pl.DataFrame) -> None:
+        self.key_event_tracking["ball_snap"] = tracking
+
+    def warm(self) -> "BigDataBowlData":
+        """
+        Load everything up front, e.g. before timing feature extraction or forking workers.
+
+        """
+        for name in ["raw_games", "raw_plays", "raw_players", "raw_player_plays", "plays_df", "tracking_data", "key_event_tracking"]:
+            getattr(self, name)
+        for name in self._get_play_index_names():
+            self._get_play_index(name)
+        return self
+
+    def _get_play_index_names(self) -> list[str]:
+        return ["play_df", "player_play_df", *[f"{event}_tracking" for event in self.key_events], "tracking_df"]
+
+    def extract_key_event_tracking(self, events: list[str], weeks: list[int] = None) -> dict:
+        """
+        Collect the tracking frames for all of the events in one scan, label offense and defense
+        once, and split the result into a frame per event. Events that never occur get an empty frame.
+
+        """
+        with instrumentation.span("key_event_tracking"):
+            tracking_data = self.tracking_data if weeks is None else self.tracking_data_processor.scan_weeks(weeks)
+            key_event_tracking = instrumentation.collect("scan", tracking_data.filter(pl.col("event").is_in(events)))
+            with instrumentation.span("offense_indicator"):
+                key_event_tracking = instrumentation.record_frame(self._add_offense_indicator_to_tracking_data(key_event_tracking))
+
+            event_frames = {key[0]: frame for key, frame in key_event_tracking.partition_by("event", as_dict=True).items()}
+        return {event: event_frames.get(event, key_event_tracking.clear()) for event in events}
+
+    def _get_play_index(self, name: str) -> PlayIndex | None:
+        if name not in self.play_indexes:
+            with instrumentation.span(f"play_index/{name}"):
+                self.play_indexes[name] = self._build_play_index(name)
+        return self.play_indexes[name]
+
+    def _build_play_index(self, name: str) -> PlayIndex | None:
+        if name == "play_df":
+            return PlayIndex(self.plays_df)
+        if name == "player_play_df":
+            return PlayIndex(self.raw_player_plays)
+        if name == "tracking_df":
+            # The full tracking data can only be sliced by offset when read from the sorted parquet store
+            return PlayIndex(self.tracking_data, is_sorted=True) if self.tracking_data_processor.store_exists() else None
+        return PlayIndex(self.key_event_tracking[name.removesuffix("_tracking")])
+
+    def get_play_tracking(self, game_id: int, play_id: int) -> pl.LazyFrame:
+        tracking_index = self._get_play_index("tracking_df")
+        if tracking_index is not None:
+            return tracking_index.get(game_id, play_id)
+        return self.tracking_data.filter((pl.col("gameId") == game_id) & (pl.col("playId") == play_id))
 
     def get_play_data(self, game_id: int, play_id: int) -> dict:
-        play_tracking_data = self.tracking_data.filter((pl.col("gameId") == game_id) & (pl.col("playId") == play_id))
-        play_plays_df = self.plays_df.filter((pl.col("gameId") == game_id) & ((pl.col("playId") == play_id)))
-        play_player_plays = self.raw_player_plays.filter((pl.col("gameId") == game_id) & ((pl.col("playId") == play_id)))
-        
-        line_set_frame = self.line_set_tracking.filter((pl.col("gameId") == game_id) & ((pl.col("playId") == play_id)))
-        ball_snap_frame = self.ball_snap_tracking.filter((pl.col("gameId") == game_id) & ((pl.col("playId") == play_id)))
+        play_tracking_data = self.get_play_tracking(game_id, play_id)
+        play_plays_df = self._get_play_index("play_df").get(game_id, play_id)
+        play_player_plays = self._get_play_index("player_play_df").get(game_id, play_id)
+
+        key_event_frames = {f"{event}_tracking": self._get_play_index(f"{event}_tracking").get(game_id, play_id) for event in self.key_events}
 
         return {
             "tracking_df": play_tracking_data,
-            "line_set_tracking": line_set_frame,
-            "ball_snap_tracking": ball_snap_frame,
+            **key_event_frames,
             "play_df": play_plays_df,
             "player_play_df": play_player_plays
         }
     
+    def _read_store_batch(self, tracking_index: PlayIndex, play_keys: list[tuple]) -> PlayIndex:
+        # Consecutive plays in the store, so the whole batch is one contiguous read
+        first_offset, _ = tracking_index.offsets[play_keys[0]]
+        last_offset, last_length = tracking_index.offsets[play_keys[-1]]
+        batch_tracking = tracking_index.df.slice(first_offset, last_offset + last_length - first_offset).collect()
+        return PlayIndex(batch_tracking, is_sorted=True)
+
+    def _get_batch_play_data(self, play_keys: list[tuple], batch_index: PlayIndex) -> list[dict]:
+        return [{
+            **self.get_play_data(*key),
+            "tracking_df": batch_index.get(*key),
+        } for key in play_keys]
+
+    def _read_play_batches(self, batch_size: int):
+        play_index = self._get_play_index("play_df")
+        tracking_index = self._get_play_index("tracking_df")
+        if tracking_index is not None:
+            play_keys = [key for key in tracking_index.offsets if key in play_index]
+            for i in range(0, len(play_keys), batch_size):
+                batch_keys = play_keys[i:i + batch_size]
+                yield self._get_batch_play_data(batch_keys, self._read_store_batch(tracking_index, batch_keys))
+            return
+
+        # Without the store each week's csv is parsed once and the week's batches are cut from it
+        for file_path in self.tracking_data_processor.tracking_data_file_paths:
+            week_index = PlayIndex(self.tracking_data_processor.scan_weeks([get_week(file_path)]).collect())
+            play_keys = [key for key in week_index.offsets if key in play_index]
+            for i in range(0, len(play_keys), batch_size):
+                yield self._get_batch_play_data(play_keys[i:i + batch_size], week_index)
+
+    def iter_plays(self, batch_size: int = 64, prefetch: int = 2):
+        """
+        Yield every play with tracking, in storage order, in lists of up to batch_size play slices keyed
+        like get_play_data, with the tracking data already collected. A background thread reads up to
+        prefetch batches ahead while the current one is processed. Set prefetch to 0 to read each batch
+        when it's needed.
+
+        With the tracking store, each batch is one contiguous slice of it and at most prefetch + 2
+        batches are held at once. Without the store, each week's csv is parsed once, sorted by play, and
+        the week's batches are cut from it, so a whole week of tracking is also held in memory.
+
+        """
+        # Build every index up front, so the reader thread only reads them
+        self.warm()
+        batches = self._read_play_batches(batch_size)
+
+        if prefetch == 0:
+            yield from batches
+            return
+
+        batch_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def read_ahead():
+            try:
+                for batch in batches:
+                    if not _put_unless_stopped(batch_queue, batch, stop):
+                        return
+                _put_unless_stopped(batch_queue, _END_OF_PLAYS, stop)
+            except Exception as e:
+                # Raised again in the consumer's thread
+                _put_unless_stopped(batch_queue, e, stop)
+
+        reader = threading.Thread(target=read_ahead, name="iter_plays_reader", daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is _END_OF_PLAYS:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Also reached when the consumer stops early, which stops the reader
+            stop.set()
+            reader.join()
+
+    def get_play_tensors(self, week: int) -> dict:
+        """
+        PlayTensors, labelled with offense and defense, for every play in a week, keyed by (gameId, playId).
+
+        """
+        with instrumentation.span("play_tensors"):
+            week_tracking = instrumentation.collect("scan", self.tracking_data.filter(pl.col("week") == week))
+            return PlayTensor.from_tracking(self._add_offense_indicator_to_tracking_data(week_tracking))
+
+    def build_tracking_cube(self, path: str, frames_before_snap: int = 50, frames_after_snap: int = 30) -> TrackingCube:
+        """
+        Write every play's tracking, from frames_before_snap frames before its ball_snap to frames_after_snap
+        after, to a memory mapped TrackingCube at path. Open it again later with TrackingCube.load(path).
+
+        """
+        with instrumentation.span("tracking_cube"):
+            return TrackingCube.build(self, path, frames_before_snap, frames_after_snap)
+
     def _add_offense_indicator_to_tracking_data(self, tracking_df):
-        tracking_df_with_offense_indicator = tracking_df.join(self.plays_df.select(["gameId", "playId", "possessionTeam"]), on=["gameId", "playId"], how="left").\
-            with_columns(
-                team=pl.when(pl.col("club") == pl.col("possessionTeam")).then(pl.lit("offense"))
-                .when(pl.col("club") != "football").then(pl.lit("defense"))
-                .otherwise(pl.lit("football"))).\
-        drop(["possessionTeam"])
-        return tracking_df_with_offense_indicator
+        return self.tracking_data_processor.add_offense_indicator(tracking_df, self.plays_df)
+
+    def sink_tracking_data(self, path: str) -> None:
+        # Only needs the possession team, so read it straight from the plays csv rather than building plays_df
+        self.tracking_data_processor.sink(path, self.non_tracking_data_processor.plays)
+
+    def ingest_tracking_weeks(self, file_paths: list[str]) -> list[int]:
+        """
+        Add new weeks of tracking csvs to the tracking store, or re-ingest weeks whose csv has changed,
+        then bring whatever is already loaded up to date by reading just those weeks: the tracking data,
+        the key event frames and the play indexes. The plays csv must already include the new plays, and
+        the games, plays and player plays loaded from the csvs are dropped, to be reloaded on next use.
+        Features cached with build_feature_tables(cache_dir) are only recomputed for the plays that changed.
+
+        Returns the weeks that were (re)ingested.
+
+        """
+        processor = self.tracking_data_processor
+        loaded_weeks = {get_week(file_path) for file_path in processor.tracking_data_file_paths}
+        processor.add_files(file_paths)
+        weeks = processor.ingest(file_paths=file_paths)
+        if not weeks:
+            return weeks
+        changed_weeks = [week for week in weeks if week in loaded_weeks]
+
+        # The csvs gain the new weeks' plays along with the tracking, and are cheap to reload
+        for name in ["non_tracking_data_processor", "raw_games", "raw_plays", "raw_players", "raw_player_plays", "plays_df"]:
+            self.__dict__.pop(name, None)
+        for name in ["play_df", "player_play_df"]:
+            self.play_indexes.pop(name, None)
+
+        if "tracking_data" in self.__dict__:
+            self.tracking_data = processor.process()
+        # Changed weeks move to the end of the store, so the offsets of every later play shift
+        if changed_weeks or not processor.store_exists():
+            self.play_indexes.pop("tracking_df", None)
+        elif self.play_indexes.get("tracking_df") is not None:
+            self.play_indexes["tracking_df"].append(processor.scan_weeks(weeks))
+
+        if "key_event_tracking" in self.__dict__:
+            week_key_event_tracking = self.extract_key_event_tracking(self.key_events, weeks)
+            for event, week_tracking in week_key_event_tracking.items():
+                self.key_event_tracking[event] = pl.concat([
+                    self.key_event_tracking[event].filter(~pl.col("week").is_in(changed_weeks)),
+                    week_tracking,
+                ])
+
+                name = f"{event}_tracking"
+                if changed_weeks:
+                    self.play_indexes.pop(name, None)
+                elif name in self.play_indexes:
+                    self.play_indexes[name].append(week_tracking)
+
+        return weeks
@@ -0,0 +1,173 @@
+# Every play's tracking data aligned on the ball snap, as one memory mapped array
+import os
+import json
+import logging
+import numpy as np
+import polars as pl
+from config import Constants
+from .play_index import PLAY_KEYS
+from .play_tensor import TENSOR_FEATURES
+
+
+# Slots 0-10 are the offense and 11-21 the defense, each ordered by nflId, and 22 is the football
+N_SLOTS = 2 * Constants.PLAYERS_PER_TEAM + 1
+FOOTBALL_SLOT = N_SLOTS - 1
+
+CUBE_FILES = {
+    "values": "values.npy",
+    "mask": "mask.npy",
+    "nfl_ids": "nfl_ids.npy",
+    "plays": "plays.parquet",
+    "metadata": "metadata.json",
+}
+
+
+class TrackingCube:
+    def __init__(self, path: str, values: np.ndarray, mask: np.ndarray, nfl_ids: np.ndarray, plays: pl.DataFrame, metadata: dict) -> None:
+        """
+        The tracking data of every play aligned on its ball_snap frame, as a float32 array of shape
+        (n_plays, n_frames, 23, n_features). Time step i of a play is the frame i - frames_before_snap
+        relative to its snap (see frame_offsets), and the slots are the 11 offensive players, the 11 defensive players
+        (each ordered by nflId) and the football. mask is True where a slot has tracking in a frame,
+        nfl_ids is the nflId in each slot of each play (-1 when empty or for the football), and plays
+        maps each gameId and playId to its row, with its snap frame and the index of its line_set frame.
+
+        Build with BigDataBowlData.build_tracking_cube, and open a built cube with TrackingCube.load,
+        which memory maps the arrays so slices of them are read from disk without copying.
+
+        """
+        self.path = path
+        self.values = values
+        self.mask = mask
+        self.nfl_ids = nfl_ids
+        self.plays = plays
+        self.metadata = metadata
+        self.play_rows = {key: row for row, key in enumerate(plays.select(PLAY_KEYS).iter_rows())}
+
+    @classmethod
+    def load(cls, path: str, mode: str = "r") -> "TrackingCube":
+        metadata_path = os.path.join(path, CUBE_FILES["metadata"])
+        # The metadata is written last, so a cube without it was never finished
+        if not os.path.exists(metadata_path):
+            raise FileNotFoundError(f"No complete tracking cube at {path}")
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        return cls(
+            path,
+            np.load(os.path.join(path, CUBE_FILES["values"]), mmap_mode=mode),
+            np.load(os.path.join(path, CUBE_FILES["mask"]), mmap_mode=mode),
+            np.load(os.path.join(path, CUBE_FILES["nfl_ids"]), mmap_mode=mode),
+            pl.read_parquet(os.path.join(path, CUBE_FILES["plays"])),
+            metadata,
+        )
+
+    @classmethod
+    def build(cls, data, path: str, frames_before_snap: int = 50, frames_after_snap: int = 30) -> "TrackingCube":
+        """
+        Write the snap aligned tracking cube of every play with a ball_snap in data, a BigDataBowlData,
+        to path. The cube is filled one week at a time, so only a week of tracking and its block of the
+        cube are held in memory.
+
+        """
+        os.makedirs(path, exist_ok=True)
+        metadata_path = os.path.join(path, CUBE_FILES["metadata"])
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+        n_frames = frames_before_snap + frames_after_snap + 1
+        plays = _get_cube_plays(data.ball_snap_tracking, data.line_set_tracking, frames_before_snap)
+        n_plays, n_features = plays.height, len(TENSOR_FEATURES)
+
+        values = np.lib.format.open_memmap(os.path.join(path, CUBE_FILES["values"]), mode="w+", dtype=np.float32, shape=(n_plays, n_frames, N_SLOTS, n_features))
+        mask = np.lib.format.open_memmap(os.path.join(path, CUBE_FILES["mask"]), mode="w+", dtype=np.bool_, shape=(n_plays, n_frames, N_SLOTS))
+        nfl_ids = np.lib.format.open_memmap(os.path.join(path, CUBE_FILES["nfl_ids"]), mode="w+", dtype=np.int32, shape=(n_plays, N_SLOTS))
+
+        n_dropped_players = 0
+        for (week,), week_plays in plays.partition_by("week", as_dict=True, maintain_order=True).items():
+            start, stop = week_plays["play_row"].min(), week_plays["play_row"].max() + 1
+            week_tracking = data.tracking_data_processor.scan_weeks([week]).\
+                join(week_plays.lazy().select(PLAY_KEYS), on=PLAY_KEYS, how="semi").\
+                collect()
+            slots = _get_slots(data._add_offense_indicator_to_tracking_data(week_tracking), week_plays, frames_before_snap, n_frames)
+            n_dropped_players += slots.filter(~pl.col("in_slots")).select(PLAY_KEYS, "nflId").n_unique()
+            slots = slots.filter(pl.col("in_slots"))
+
+            # Fill the week's block in memory, then write it to the memory map in one go
+            rows = slots["play_row"].to_numpy() - start
+            frame_indexes = slots["frame_index"].to_numpy()
+            slot_indexes = slots["slot"].to_numpy()
+            week_values = np.full((stop - start, n_frames, N_SLOTS, n_features), np.nan, dtype=np.float32)
+            week_values[rows, frame_indexes, slot_indexes] = slots.select(TENSOR_FEATURES).to_numpy().astype(np.float32)
+            week_mask = np.zeros((stop - start, n_frames, N_SLOTS), dtype=np.bool_)
+            week_mask[rows, frame_indexes, slot_indexes] = True
+            week_nfl_ids = np.full((stop - start, N_SLOTS), -1, dtype=np.int32)
+            week_nfl_ids[rows, slot_indexes] = slots["nflId"].fill_null(-1).to_numpy()
+
+            values[start:stop], mask[start:stop], nfl_ids[start:stop] = week_values, week_mask, week_nfl_ids
+            logging.info(f"Added week {week} to the tracking cube at {path}")
+
+        if n_dropped_players > 0:
+            logging.warning(f"Left out {n_dropped_players} players on teams with more than {Constants.PLAYERS_PER_TEAM} players in a play")
+
+        for array in [values, mask, nfl_ids]:
+            array.flush()
+        plays.write_parquet(os.path.join(path, CUBE_FILES["plays"]))
+        metadata = {
+            "frames_before_snap": frames_before_snap,
+            "frames_after_snap": frames_after_snap,
+            "features": TENSOR_FEATURES,
+            "n_plays": n_plays,
+        }
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f, indent=2)
+
+        return cls.load(path)
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    @property
+    def frame_offsets(self) -> np.ndarray:
+        # The frame of each time step relative to the snap
+        return np.arange(-self.metadata["frames_before_snap"], self.metadata["frames_after_snap"] + 1)
+
+    def get_play_row(self, game_id: int, play_id: int) -> int:
+        if (game_id, play_id) not in self.play_rows:
+            raise KeyError(f"No play {game_id}, {play_id} in the tracking cube")
+        return self.play_rows[(game_id, play_id)]
+
+    def get_play(self, game_id: int, play_id: int) -> np.ndarray:
+        return self.values[self.get_play_row(game_id, play_id)]
+
+    def get_frames(self, start: int, stop: int) -> np.ndarray:
+        # Frames from start up to stop relative to the snap, for every play
+        frames_before_snap = self.metadata["frames_before_snap"]
+        return self.values[:, max(start + frames_before_snap, 0):stop + frames_before_snap]
+
+    def get_feature(self, feature: str) -> np.ndarray:
+        return self.values[..., self.metadata["features"].index(feature)]
+
+
+def _get_cube_plays(ball_snap_tracking: pl.DataFrame, line_set_tracking: pl.DataFrame, frames_before_snap: int) -> pl.DataFrame:
+    # One row per play with a snap, grouped by week so each week fills a contiguous block of the cube
+    line_set_frames = line_set_tracking.group_by(PLAY_KEYS).agg(line_set_frame=pl.col("frameId").min())
+    return ball_snap_tracking.\
+        group_by([*PLAY_KEYS, "week"]).\
+        agg(ball_snap_frame=pl.col("frameId").min()).\
+        sort(["week", *PLAY_KEYS]).\
+        join(line_set_frames, on=PLAY_KEYS, how="left").\
+        with_row_index("play_row").\
+        with_columns(line_set_index=pl.col("line_set_frame") - pl.col("ball_snap_frame") + frames_before_snap)
+
+
+def _get_slots(week_tracking: pl.DataFrame, week_plays: pl.DataFrame, frames_before_snap: int, n_frames: int) -> pl.DataFrame:
+    team_rank = (pl.col("nflId").rank("dense") - 1).over([*PLAY_KEYS, "team"])
+    return week_tracking.\
+        join(week_plays.select(*PLAY_KEYS, "play_row", "ball_snap_frame"), on=PLAY_KEYS, how="inner").\
+        with_columns(frame_index=pl.col("frameId").cast(pl.Int64) - pl.col("ball_snap_frame") + frames_before_snap).\
+        filter((pl.col("frame_index") >= 0) & (pl.col("frame_index") < n_frames)).\
+        with_columns(slot=pl.when(pl.col("team") == "football").then(FOOTBALL_SLOT)
+                     .when(pl.col("team") == "offense").then(team_rank)
+                     .otherwise(team_rank + Constants.PLAYERS_PER_TEAM)).\
+        with_columns(in_slots=(pl.col("team") == "football") | (team_rank < Constants.PLAYERS_PER_TEAM))
@@ -1,45 +1,285 @@
 # Import and process tracking data
+import os
+import re
+import json
+import hashlib
 import polars as pl
 import logging
 from config import Constants
+from .non_tracking_data import TEAM_ABBREVIATIONS
+
+
+# Explicit dtypes for the weekly tracking csvs, so they don't need to be inferred on every scan
+TRACKING_DATA_SCHEMA = {
+    "gameId": pl.Int64,
+    "playId": pl.Int64,
+    "nflId": pl.Int64,
+    "displayName": pl.String,
+    "frameId": pl.Int64,
+    "frameType": pl.String,
+    "time": pl.String,
+    "jerseyNumber": pl.Int64,
+    "club": pl.String,
+    "playDirection": pl.String,
+    "x": pl.Float64,
+    "y": pl.Float64,
+    "s": pl.Float64,
+    "a": pl.Float64,
+    "dis": pl.Float64,
+    "o": pl.Float64,
+    "dir": pl.Float64,
+    "event": pl.String,
+}
+
+TRACKING_DATA_SORT_KEYS = ["gameId", "playId", "frameId", "nflId"]
+
+# The Kaggle files are named tracking_week_1.csv to tracking_week_9.csv
+TRACKING_WEEK_PATTERN = re.compile(r"week_(\d+)")
+
+CLUBS = pl.Enum([*TEAM_ABBREVIATIONS.categories, "football"])
+TEAMS = pl.Enum(["offense", "defense", "football"])
+
+# Dtypes the tracking data is cast to on load, which take under half the memory of TRACKING_DATA_SCHEMA.
+# gameId and playId stay Int64 to join with the non-tracking data. team is the dtype of the label added by
+# add_offense_indicator. Pass TRACKING_DATA_SCHEMA as the dtypes to keep the full width columns.
+COMPACT_TRACKING_DTYPES = {
+    "nflId": pl.Int32,
+    "frameId": pl.Int16,
+    "jerseyNumber": pl.UInt8,
+    "club": CLUBS,
+    "playDirection": pl.Enum(["left", "right"]),
+    "x": pl.Float32,
+    "y": pl.Float32,
+    "s": pl.Float32,
+    "a": pl.Float32,
+    "dis": pl.Float32,
+    "o": pl.Float32,
+    "dir": pl.Float32,
+    # Events are an open set, so they are categorical rather than an enum
+    "event": pl.Categorical,
+    "week": pl.UInt8,
+    "team": TEAMS,
+}
+
+
+def report_dtype_savings(df: pl.DataFrame, full_width_dtypes: dict = TRACKING_DATA_SCHEMA) -> pl.DataFrame:
+    """
+    Estimated bytes of each column of df, against the bytes it would take cast to full_width_dtypes
+    (strings for enum and categorical columns, 64 bit otherwise), with a total row.
+
+    """
+    rows = []
+    for column in df.columns:
+        series = df[column]
+        if column in full_width_dtypes:
+            full_width_dtype = full_width_dtypes[column]
+        elif isinstance(series.dtype, (pl.Enum, pl.Categorical)):
+            full_width_dtype = pl.String
+        elif series.dtype.is_float():
+            full_width_dtype = pl.Float64
+        elif series.dtype.is_integer():
+            full_width_dtype = pl.Int64
+        else:
+            full_width_dtype = series.dtype
+        rows.append({
+            "column": column,
+            "dtype": str(series.dtype),
+            "full_width_dtype": str(full_width_dtype),
+            "bytes": series.estimated_size(),
+            "full_width_bytes": series.cast(full_width_dtype).estimated_size(),
+        })
+
+    report = pl.DataFrame(rows)
+    report = pl.concat([report, report.select(pl.lit("total").alias("column"), pl.lit(None, pl.String).alias("dtype"),
+                                              pl.lit(None, pl.String).alias("full_width_dtype"), pl.col("bytes", "full_width_bytes").sum())])
+    return report.with_columns(bytes_saved=pl.col("full_width_bytes") - pl.col("bytes"))
+
+
+def get_week(file_path: str) -> int:
+    match = TRACKING_WEEK_PATTERN.search(os.path.basename(file_path))
+    if match is None:
+        raise ValueError(f"Can't find the week in the tracking file name {file_path}, expected e.g. tracking_week_1.csv")
+    return int(match.group(1))
+
+
+def _hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
 
 class TrackingDataProcessor:
-    def __init__(self, tracking_data_file_paths: list[str]) -> None:
+    def __init__(self, tracking_data_file_paths: list[str], store_path: str = None, dtypes: dict = COMPACT_TRACKING_DTYPES) -> None:
         if not isinstance(tracking_data_file_paths, list):
             raise ValueError("tracking_data_file_paths must be a list of strings.")
         self.tracking_data_file_paths = tracking_data_file_paths
+        self.store_path = store_path
+        self.dtypes = dtypes
         self.tracking_data = None  # Initialize to None
 
+    def _scan_tracking_csv(self, file_path: str) -> pl.LazyFrame:
+        tracking_data = pl.scan_csv(file_path, schema_overrides=TRACKING_DATA_SCHEMA, null_values="NA")
+        # Append the week
+        tracking_data = tracking_data.with_columns(
+            week=pl.lit(get_week(file_path))
+        )
+        return tracking_data
+
+    def _cast_to_dtypes(self, tracking_data: pl.LazyFrame) -> pl.LazyFrame:
+        columns = tracking_data.collect_schema().names()
+        return tracking_data.cast({column: dtype for column, dtype in self.dtypes.items() if column in columns})
+
+    def _get_store_file_path(self, file_path: str) -> str:
+        return os.path.join(self.store_path, f"tracking_week_{get_week(file_path)}.parquet")
+
+    def _get_manifest_path(self) -> str:
+        return os.path.join(self.store_path, "manifest.json")
+
+    def _read_manifest(self) -> dict:
+        # The source file and hash of each stored week, keyed by the week as a string
+        if not os.path.exists(self._get_manifest_path()):
+            return {}
+        with open(self._get_manifest_path()) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        temp_path = self._get_manifest_path() + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self._get_manifest_path())
+
+    def store_exists(self) -> bool:
+        if self.store_path is None:
+            return False
+        return all(os.path.exists(self._get_store_file_path(file_path)) for file_path in self.tracking_data_file_paths)
+
+    def add_files(self, file_paths: list[str]) -> None:
+        # A file for a week that is already loaded replaces it, new weeks are added at the end
+        weeks = {get_week(file_path) for file_path in file_paths}
+        self.tracking_data_file_paths = [file_path for file_path in self.tracking_data_file_paths if get_week(file_path) not in weeks] + file_paths
+
+    def ingest(self, overwrite: bool = False, file_paths: list[str] = None) -> list[int]:
+        """
+        Convert the weekly tracking csvs (all of them, or just file_paths) into the parquet store,
+        one file per week, sorted by gameId, playId, frameId, nflId. Weeks already stored from a csv
+        with the same contents are skipped, so this can be rerun as new weeks arrive.
+
+        Returns the weeks that were (re)written.
+
+        """
+        if self.store_path is None:
+            raise ValueError("store_path must be set to ingest the tracking data.")
+        os.makedirs(self.store_path, exist_ok=True)
+
+        manifest = self._read_manifest()
+        ingested_weeks = []
+        for file_path in file_paths or self.tracking_data_file_paths:
+            week = get_week(file_path)
+            store_file_path = self._get_store_file_path(file_path)
+            file_hash = _hash_file(file_path)
+            if os.path.exists(store_file_path) and manifest.get(str(week), {}).get("sha256") == file_hash and not overwrite:
+                logging.info(f"Skipping {file_path}, already stored at {store_file_path}")
+                continue
+
+            # Written to a temporary file first so an interrupted ingest can't leave a partial week
+            temp_path = store_file_path + ".tmp"
+            # Enums are stored as strings, as Polars can't slice a scan of several parquet files with enum
+            # columns from past the first file. They are cast back on load.
+            self._cast_to_dtypes(self._scan_tracking_csv(file_path)).\
+                with_columns(pl.col(pl.Enum).cast(pl.String)).\
+                sort(TRACKING_DATA_SORT_KEYS, nulls_last=True).\
+                collect().\
+                write_parquet(temp_path)
+            os.replace(temp_path, store_file_path)
+
+            manifest[str(week)] = {"source": os.path.abspath(file_path), "sha256": file_hash}
+            self._write_manifest(manifest)
+            ingested_weeks.append(week)
+            logging.info(f"Ingested file {file_path} to {store_file_path}")
+
+        return ingested_weeks
+
+    def scan_weeks(self, weeks: list[int]) -> pl.LazyFrame:
+        """
+        The normalised tracking data of just the given weeks, read from the store if it exists.
+
+        """
+        file_paths = [file_path for file_path in self.tracking_data_file_paths if get_week(file_path) in weeks]
+        if self.store_exists():
+            tracking_data = pl.scan_parquet([self._get_store_file_path(file_path) for file_path in file_paths])
+        else:
+            tracking_data = pl.concat([self._scan_tracking_csv(file_path) for file_path in file_paths])
+        return self._normalise(self._cast_to_dtypes(tracking_data))
+
     def _load_tracking_data(self) -> None:
-        tracking_data_list = []
-        for file_path in self.tracking_data_file_paths:
-            tracking_data = pl.scan_csv(file_path, ignore_errors=True)
-            # Append the week
-            tracking_data = tracking_data.with_columns(
-                week=pl.lit(int(file_path[-5]))
-            )
-            tracking_data_list.append(tracking_data)
-            logging.info(f"Loaded file {file_path}")
-        tracking_data = pl.concat(tracking_data_list)
-        self.tracking_data = tracking_data
-        logging.info(f"Total dataframe has shape: {tracking_data.select(pl.len()).collect().item()}")
-    
+        if self.store_exists():
+            store_file_paths = [self._get_store_file_path(file_path) for file_path in self.tracking_data_file_paths]
+            tracking_data = pl.scan_parquet(store_file_paths)
+            logging.info(f"Loaded tracking data store {self.store_path}")
+            # Cheap for parquet, as the row count is read from the file metadata
+            logging.info(f"Total dataframe has shape: {tracking_data.select(pl.len()).collect().item()}")
+        else:
+            tracking_data_list = []
+            for file_path in self.tracking_data_file_paths:
+                tracking_data_list.append(self._scan_tracking_csv(file_path))
+                logging.info(f"Loaded file {file_path}")
+            tracking_data = pl.concat(tracking_data_list)
+        # A no-op for a store ingested with the same dtypes
+        self.tracking_data = self._cast_to_dtypes(tracking_data)
+
     def _normalise_features(self) -> pl.DataFrame:
-        tracking_data = self.tracking_data
+        self.tracking_data = self._normalise(self.tracking_data)
 
+    def _normalise(self, tracking_data: pl.LazyFrame) -> pl.LazyFrame:
         # Normalise features
-        tracking_data = tracking_data.with_columns(
+        return tracking_data.with_columns(
             x=pl.when(pl.col("playDirection") == "left").then(Constants.X_MAX - pl.col("x")).otherwise(pl.col("x")),
             y=pl.when(pl.col("playDirection") == "left").then(Constants.Y_MAX - pl.col("y")).otherwise(pl.col("y")),
             # TODO: Check the logic of the dir normalisation, is different in R code
             dir=pl.when(pl.col("playDirection") == "left").then((pl.col("dir") + 180) % 360).otherwise(pl.col("dir")),
             o=pl.when(pl.col("playDirection") == "left").then((pl.col("o") + 180) % 360).otherwise(pl.col("o")),
-            
+
         )
-        self.tracking_data = tracking_data
 
     def process(self):
         self._load_tracking_data()
         self._normalise_features()
         return self.tracking_data
+
+    def add_offense_indicator(self, tracking_data, possession_teams):
+        """
+        Label each row's team as offense, defense or football, given a frame with the
+        gameId, playId and possessionTeam of each play.
+
+        """
+        # Compared as strings, as club and possessionTeam can be enums with different categories
+        return tracking_data.join(possession_teams.select(["gameId", "playId", pl.col("possessionTeam").cast(pl.String)]), on=["gameId", "playId"], how="left").\
+            with_columns(
+                team=pl.when(pl.col("club").cast(pl.String) == pl.col("possessionTeam")).then(pl.lit("offense"))
+                .when(pl.col("club") != "football").then(pl.lit("defense"))
+                .otherwise(pl.lit("football"))
+                .cast(self.dtypes.get("team", pl.String))).\
+            drop(["possessionTeam"])
+
+    def sink(self, path: str, possession_teams: pl.LazyFrame = None) -> None:
+        """
+        Load, normalise and (if possession_teams is given) label offense and defense for all of the
+        tracking data, streaming it straight to a single parquet file so the full season is never
+        held in memory at once.
+
+        """
+        tracking_data = self.process()
+        if possession_teams is not None:
+            tracking_data = self.add_offense_indicator(tracking_data, possession_teams.lazy())
+
+        # Any step the streaming engine can't run would be collected in memory first
+        plan = tracking_data.explain(streaming=True)
+        if not plan.startswith("STREAMING:"):
+            raise ValueError(f"Tracking data export can't run fully in the streaming engine:\n{plan}")
+
+        # Each week's file has its own categorical encoding, so share one while they are combined
+        with pl.StringCache():
+            tracking_data.sink_parquet(path)
+        logging.info(f"Sank tracking data to {path}")
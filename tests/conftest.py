@@ -0,0 +1,8 @@
+import pytest
+from benchmarks import generate_synthetic_data
+
+
+@pytest.fixture(scope="session")
+def synthetic_file_paths(tmp_path_factory):
+    # A small season in the layout of the Kaggle files, keyed like the arguments of BigDataBowlData
+    return generate_synthetic_data(str(tmp_path_factory.mktemp("synthetic")), n_weeks=2, games_per_week=1, plays_per_game=3, frames_per_play=30)
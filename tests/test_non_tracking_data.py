@@ -0,0 +1,41 @@
+import polars as pl
+from preprocessing.non_tracking_data import NonTrackingDataProcessor
+
+
+# How Python UDFs (map_elements, map_batches) show up in a query plan
+PYTHON_UDF_PLAN_MARKERS = ["map_list()", "python_udf()", "OPAQUE_PYTHON"]
+
+
+def get_processor(file_paths, player_plays_file_path=None):
+    return NonTrackingDataProcessor(file_paths["games_file_path"],
+                                    file_paths["plays_file_path"],
+                                    file_paths["player_file_path"],
+                                    player_plays_file_path or file_paths["player_plays_file_path"])
+
+
+def test_in_motion_at_snap_ran_route_counts_named_routes(synthetic_file_paths, tmp_path):
+    player_plays_file_path = tmp_path / "player_play.csv"
+    pl.DataFrame({
+        "gameId": [1, 1, 1, 1],
+        "playId": [1, 1, 1, 1],
+        "nflId": [10, 11, 12, 13],
+        "teamAbbr": ["KC", "KC", "KC", "KC"],
+        "wasTargettedReceiver": [1, 0, 0, 0],
+        "yardageGainedAfterTheCatch": [5, None, None, None],
+        "inMotionAtBallSnap": [True, True, False, True],
+        "shiftSinceLineset": [False, False, False, False],
+        "motionSinceLineset": [False, False, False, False],
+        "routeRan": ["GO", None, "OUT", "SLANT"],
+        "pff_defensiveCoverageAssignment": [None, None, None, None],
+    }).write_csv(player_plays_file_path, null_value="NA")
+
+    aggregated = get_processor(synthetic_file_paths, player_plays_file_path)._aggregate_player_plays_df().collect()
+
+    assert aggregated["playerInMotionAtSnapRanRoute"].to_list() == [2]
+
+
+def test_play_features_have_no_python_udfs(synthetic_file_paths):
+    # Python UDFs run row by row and hold the GIL, so the play features are built from native expressions
+    query_plan = get_processor(synthetic_file_paths).feature_engineer_play_data().explain(optimized=False)
+
+    assert [marker for marker in PYTHON_UDF_PLAN_MARKERS if marker in query_plan] == []
@@ -0,0 +1,25 @@
+import pytest
+from preprocessing.preprocessing import BigDataBowlData
+from preprocessing.play_prediction import PlayPredictionModel
+
+
+def test_feature_tables_use_configured_key_events(synthetic_file_paths, tmp_path):
+    model = PlayPredictionModel(BigDataBowlData(**synthetic_file_paths, key_events=["man_in_motion"]))
+    frames = ["line_set", "man_in_motion"]
+
+    tables = model.build_feature_tables(frames=frames)
+    assert tables["man_in_motion_spatial_features"].height == model.data.plays_df.height
+
+    extracted, errors = model.extract_all(n_workers=1, frames=frames)
+    assert extracted["man_in_motion_spatial_features"].equals(tables["man_in_motion_spatial_features"])
+    assert errors.is_empty()
+
+    cached = model.build_feature_tables(frames=frames, cache_dir=str(tmp_path / "features"))
+    assert cached["man_in_motion_spatial_features"].sort("gameId", "playId").equals(tables["man_in_motion_spatial_features"].sort("gameId", "playId"))
+
+
+def test_feature_tables_reject_frames_that_are_not_key_events(synthetic_file_paths):
+    model = PlayPredictionModel(BigDataBowlData(**synthetic_file_paths))
+
+    with pytest.raises(ValueError, match="man_in_motion"):
+        model.build_feature_tables(frames=["line_set", "man_in_motion"])
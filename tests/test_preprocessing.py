@@ -0,0 +1,25 @@
+import shutil
+import polars as pl
+from preprocessing.preprocessing import BigDataBowlData
+
+
+def test_ingest_tracking_weeks_reloads_plays_for_new_weeks(synthetic_file_paths, tmp_path):
+    # A session that loaded the plays before the next week's plays and tracking were published
+    file_paths = {**synthetic_file_paths, "plays_file_path": str(tmp_path / "plays.csv")}
+    week_1_file_path, week_2_file_path = synthetic_file_paths["tracking_data_file_paths"]
+    week_1_games = pl.read_csv(synthetic_file_paths["games_file_path"]).filter(pl.col("week") == 1)["gameId"]
+    pl.read_csv(synthetic_file_paths["plays_file_path"], infer_schema_length=0).\
+        filter(pl.col("gameId").cast(pl.Int64).is_in(week_1_games)).\
+        write_csv(file_paths["plays_file_path"])
+
+    data = BigDataBowlData(**{**file_paths, "tracking_data_file_paths": [week_1_file_path]}, tracking_store_path=str(tmp_path / "store"))
+    data.tracking_data_processor.ingest()
+    data.warm()
+
+    shutil.copy(synthetic_file_paths["plays_file_path"], file_paths["plays_file_path"])
+    assert data.ingest_tracking_weeks([week_2_file_path]) == [2]
+
+    game_id, play_id = data.plays_df.filter(~pl.col("gameId").is_in(week_1_games)).select("gameId", "playId").row(0)
+    play_data = data.get_play_data(game_id, play_id)
+    assert play_data["play_df"].height == 1
+    assert set(play_data["line_set_tracking"]["team"]) == {"offense", "defense", "football"}